@@ -0,0 +1,133 @@
+from os import path, chdir, makedirs, listdir
+from time import perf_counter
+from json import load, dump
+from shutil import copy, rmtree
+from datetime import datetime
+from argparse import ArgumentParser
+from subprocess import run
+import platform
+import sys
+import tracemalloc
+
+BENCHMARK_FOLDER = path.dirname(path.abspath(__file__))
+ROOT_FOLDER = path.dirname(BENCHMARK_FOLDER)
+sys.path.insert(0, path.join(ROOT_FOLDER, 'src'))
+
+# LOCAL IMPORTS
+from generateTransactions import generateProject
+from utils import dataLoader, stats
+import app
+
+# Maximum startup time of the status command (seconds)
+STATUS_BUDGET = 1
+
+def measure(function, args = (), setup = None, memory = True):
+
+    # (1) Wall time
+    if setup:
+        setup()
+    start = perf_counter()
+    result = function(*args)
+    measures = {'time': perf_counter() - start}
+
+    # (2) Peak of the memory allocated by Python (second run, tracemalloc slows down the execution)
+    if memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        function(*args)
+        measures['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, measures
+
+def resetData(projectFolder, csvFile):
+
+    # Empty store, memos and caches with only the export to import
+    dataFolder = path.join(projectFolder, 'data')
+    rmtree(dataFolder, ignore_errors = True)
+    makedirs(dataFolder)
+    copy(csvFile, dataFolder)
+
+def statusStartup(projectFolder):
+    start = perf_counter()
+    run([sys.executable, path.join(ROOT_FOLDER, 'src', 'app.py'), 'status'], cwd = projectFolder, capture_output = True, check = True)
+    return perf_counter() - start
+
+def benchmarkSize(rows, memory = True):
+    projectFolder = path.join(BENCHMARK_FOLDER, 'projects', str(rows))
+
+    # Synthetic export (generated once for each size)
+    csvFile = path.join(projectFolder, f'ListaMovimentiCsv_{rows}.csv')
+    if not path.exists(csvFile):
+        generateProject(projectFolder, rows)
+        copy(path.join(projectFolder, 'data', f'ListaMovimentiCsv_{rows}.csv'), csvFile)
+    chdir(projectFolder)
+    outputFolder, graphFolder = path.join(projectFolder, 'outputs'), path.join(projectFolder, 'outputs', 'graphs')
+    makedirs(graphFolder, exist_ok = True)
+    reset = lambda: resetData(projectFolder, csvFile)
+
+    results = dict()
+    _, results['readCSVTransactions'] = measure(dataLoader.readCSVTransactions, (csvFile, ), memory = memory)
+    imported, results['importTransactions'] = measure(dataLoader.importTransactions, (projectFolder, ), setup = reset, memory = memory)
+    _, results['describeTransactions'] = measure(lambda: dataLoader.describeTransactions(imported.copy(), path.join(projectFolder, 'taxonomies')), memory = memory)
+    (df, *_), results['loadTransactions'] = measure(app.importMovements, (projectFolder, app.readConfig(), False), setup = reset, memory = memory)
+    cube, results['build_cube'] = measure(stats.build_cube, (df, ), memory = memory)
+
+    # Reports
+    for feature in ['CATEGORIA', 'CAUSALE ABI']:
+        _, results[f'group_expensive ({feature})'] = measure(stats.group_expensive, (cube, outputFolder, feature), memory = memory)
+    _, results['compute_incomes'] = measure(stats.compute_incomes, (cube, outputFolder), memory = memory)
+    _, results['monthly_stats'] = measure(stats.monthly_stats, (cube, outputFolder), memory = memory)
+    _, results['expensive_graphs'] = measure(stats.expensive_graphs, (cube, graphFolder), memory = memory)
+
+    # Startup of the quickest command (new interpreter)
+    results['status startup'] = {'time': min(statusStartup(projectFolder) for _ in range(3))}
+    if results['status startup']['time'] > STATUS_BUDGET:
+        print(f"[WARNING] The status command took {results['status startup']['time']:.2f} s (budget: {STATUS_BUDGET} s)")
+
+    chdir(ROOT_FOLDER)
+    return results
+
+def commitName():
+    commit = run(['git', 'rev-parse', '--short', 'HEAD'], cwd = ROOT_FOLDER, capture_output = True, text = True).stdout.strip()
+    changes = run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd = ROOT_FOLDER, capture_output = True, text = True).stdout.strip()
+    return (commit or 'unknown') + ('-dirty' if changes else '')
+
+def printResults(results, reference = None):
+    for rows, stages in results.items():
+        print(f"\n{int(rows):,} transactions")
+        for stage, measures in stages.items():
+            line = f"  {stage:<35} {measures['time']:>9.3f} s"
+            if 'peak_mb' in measures:
+                line += f" {measures['peak_mb']:>10.1f} MB"
+            if reference and stage in reference.get(rows, {}):
+                line += f"   (x{measures['time'] / reference[rows][stage]['time']:.2f} time)"
+            print(line)
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description = "Time and memory-profile the pipeline stages on synthetic Inbank exports")
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [1_000, 10_000, 100_000])
+    parser.add_argument('--no-memory', action = 'store_true', help = "Skip the tracemalloc runs")
+    parser.add_argument('--compare', help = "Commit of the results to compare with (benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    results = {str(rows): benchmarkSize(rows, memory = not args.no_memory) for rows in args.sizes}
+
+    # Save the results of this commit
+    resultsFolder = path.join(BENCHMARK_FOLDER, 'results')
+    makedirs(resultsFolder, exist_ok = True)
+    commit = commitName()
+    with open(path.join(resultsFolder, commit + '.json'), 'w') as jsonFile:
+        dump({'commit': commit, 'date': datetime.now().isoformat(timespec = 'seconds'), 'python': platform.python_version(),
+              'platform': platform.platform(), 'results': results}, jsonFile, indent = 4)
+
+    # Compare with a previous commit
+    reference = None
+    if args.compare:
+        matches = [fileName for fileName in listdir(resultsFolder) if fileName.startswith(args.compare)]
+        if len(matches) == 0:
+            print(f"[WARNING] No results for the commit {args.compare}")
+        else:
+            with open(path.join(resultsFolder, matches[0])) as jsonFile:
+                reference = load(jsonFile)['results']
+    printResults(results, reference)
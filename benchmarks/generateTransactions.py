@@ -0,0 +1,135 @@
+from os import path, makedirs
+from json import dump
+from hashlib import md5
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+
+# Merchants (keyword used by the taxonomy, name in the bank description) of each category
+MERCHANTS = {
+    'Food': ['COOP', 'ESSELUNGA', 'CONAD', 'CARREFOUR', 'LIDL', 'PAM PANORAMA', 'EUROSPIN'],
+    'Transportation': ['ENI', 'Q8', 'TRENITALIA', 'ITALO', 'ATM MILANO', 'TELEPASS'],
+    'Education & Culture': ['FELTRINELLI', 'MONDADORI', 'CINEMA ODEON', 'UDEMY'],
+    'Bills': ['ENEL ENERGIA', 'TIM SPA', 'A2A', 'FASTWEB', 'ILIAD'],
+    'Health': ['FARMACIA', 'CENTRO MEDICO', 'DENTISTA'],
+    'Restaurants': ['RISTORANTE', 'PIZZERIA', 'BAR ', 'SUSHI'],
+    'Investments': ['DIRECTA SIM', 'SCALABLE CAPITAL']}
+UNKNOWN_MERCHANTS = ['NEGOZIO', 'MERCATO', 'FERRAMENTA', 'TABACCHI', 'EDICOLA']
+PEOPLE = ['MARIO ROSSI', 'LUIGI VERDI', 'ANNA BIANCHI', 'GIULIA NERI', 'PAOLO GALLI']
+CITIES = ['MILANO', 'ROMA', 'TORINO', 'BOLOGNA', 'TRENTO']
+
+# ABI codes of the Inbank exports
+ABI_CODES = {'43': 'Pagamento POS', '50': 'Pagamenti diversi', '48': 'Bonifico in uscita', '34': 'Imposte e tasse',
+             '27': 'Stipendio', '26': 'Bonifico in entrata', '66': 'Cedole'}
+
+# Kind of transaction: (share of the rows, ABI code, outgoing, min and max amount)
+KINDS = {'POS': (0.55, '43', True, 1, 150), 'SDD': (0.15, '50', True, 5, 300), 'Bonifico': (0.12, '48', True, 10, 1500),
+         'Polizza': (0.03, '34', True, 2, 35), 'Stipendio': (0.05, '27', False, 1500, 3000),
+         'Ordinante': (0.07, '26', False, 10, 800), 'Cedole': (0.03, '66', False, 5, 400)}
+
+def generateTransactions(rows, seed = 0, end = None):
+    rng = np.random.default_rng(seed)
+
+    # ~1500 transactions per day at most (at least two years of movements, up to today)
+    days = max(730, int(np.ceil(rows / 1500)))
+    end = pd.Timestamp(end) if end else pd.Timestamp.today().normalize()
+    valuta = end - pd.to_timedelta(np.sort(rng.integers(0, days, rows))[::-1], unit = 'D')
+    data = valuta - pd.to_timedelta(rng.choice([0, 0, 0, 1, 2], rows), unit = 'D')
+
+    # Kind of each transaction
+    kinds = list(KINDS.keys())
+    kind = rng.choice(len(kinds), rows, p = [KINDS[name][0] for name in kinds])
+    outgoing = np.array([KINDS[name][2] for name in kinds])[kind]
+
+    # Amounts in cents, unique within each day (the store deduplicates on VALUTA and IMPORTO)
+    lows, highs = np.array([KINDS[name][3] for name in kinds]) * 100, np.array([KINDS[name][4] for name in kinds]) * 100
+    cents = rng.integers(lows[kind], highs[kind])
+    while True:
+        duplicates = pd.DataFrame({'VALUTA': valuta, 'IMPORTO': np.where(outgoing, -cents, cents)}).groupby(['VALUTA', 'IMPORTO']).cumcount().to_numpy()
+        if not duplicates.any():
+            break
+        cents += duplicates
+
+    # Descriptions
+    merchants = np.array([merchant for names in MERCHANTS.values() for merchant in names] + UNKNOWN_MERCHANTS, dtype = object)
+    merchant = merchants[rng.integers(0, len(merchants), rows)]
+    city = np.array(CITIES, dtype = object)[rng.integers(0, len(CITIES), rows)]
+    person = np.array(PEOPLE, dtype = object)[rng.integers(0, len(PEOPLE), rows)]
+    day = pd.Series(data).dt.strftime('%d/%m').to_numpy(dtype = object)
+    hour = pd.Series(rng.integers(7, 23, rows)).astype(str).str.zfill(2).to_numpy(dtype = object)
+    amounts = pd.Series(cents / 100).map('{:.2f}'.format).str.replace('.', ',').to_numpy(dtype = object)
+
+    descriptions = np.empty(rows, dtype = object)
+    templates = {
+        'POS': "PAGAMENTO TRAMITE POS DEL " + day + " ORE " + hour + ":00 CARTA 5354****1234 PRESSO: " + merchant + " " + city,
+        'SDD': "PAGAMENTI DIVERSI CRED. " + merchant + " ID.MANDATO " + hour + "0042 IMP. E " + amounts,
+        'Bonifico': "VOSTRA DISPOSIZIONE A FAVORE A FAV: " + person + " - IBAN IT60X0542811101000000123456 ID.MSG " + hour + "77",
+        'Polizza': "IMPOSTE E TASSE POLIZZA 000123 PERIODO BOLLO " + pd.Series(valuta.year).astype(str).to_numpy(dtype = object),
+        'Stipendio': np.full(rows, "ACCREDITO PER EMOLUMENTI ACME SPA ACCREDITO COMPETENZE", dtype = object),
+        'Ordinante': "BONIFICO ORDINANTE: " + person + " CAUSALE: RIMBORSO " + day,
+        'Cedole': np.full(rows, "ACCREDITO CEDOLE BTP 2030 QUANTITA 1000", dtype = object)}
+    for idk, name in enumerate(kinds):
+        descriptions[kind == idk] = templates[name][kind == idk]
+
+    df = pd.DataFrame({'DATA': data.strftime('%d/%m/%Y'), 'VALUTA': valuta.strftime('%d/%m/%Y'),
+                       'DARE': np.where(outgoing, cents / 100, np.nan), 'AVERE': np.where(outgoing, np.nan, cents / 100),
+                       'DESCRIZIONE OPERAZIONE': descriptions, 'CAUSALE ABI': np.array([KINDS[name][1] for name in kinds])[kind]})
+    return df.iloc[::-1].reset_index(drop = True)
+
+def writeInbankCSV(df, filePath, chunkSize = 500_000):
+
+    # Inbank layout: semicolons, Italian decimals, trailing separator and a footer row
+    with open(filePath, 'w', encoding = 'UTF-8', newline = '') as csvFile:
+        csvFile.write(';'.join(df.columns) + ';\n')
+        for start in range(0, len(df), chunkSize):
+            chunk = df.iloc[start:start + chunkSize].copy()
+            for col in ['DARE', 'AVERE']:
+                chunk[col] = chunk[col].map('{:,.2f}'.format, na_action = 'ignore').str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
+            chunk['END'] = ''
+            chunk.to_csv(csvFile, sep = ';', header = False, index = False, lineterminator = '\n')
+        csvFile.write(f"Saldo contabile al {df['VALUTA'].iloc[0]};;;;;;\n")
+
+def writeTaxonomies(projectFolder, df):
+    folderData = path.join(projectFolder, 'taxonomies')
+    makedirs(folderData, exist_ok = True)
+
+    with open(path.join(folderData, 'expensiveCategories.json'), 'w') as jsonFile:
+        dump(MERCHANTS, jsonFile, indent = 4)
+    with open(path.join(folderData, 'causaliABI.json'), 'w') as jsonFile:
+        dump(ABI_CODES, jsonFile, indent = 4)
+
+    # A few one-off transactions (gifts to people)
+    gifts = df.loc[df['DESCRIZIONE OPERAZIONE'].str.contains('A FAV: ANNA BIANCHI', regex = False), 'DESCRIZIONE OPERAZIONE'].unique()[:20]
+    with open(path.join(folderData, 'oneOffTransactions.json'), 'w') as jsonFile:
+        dump({'Gifts': [md5(desc.encode('UTF-8')).hexdigest() for desc in gifts]}, jsonFile, indent = 4)
+
+    categories = list(MERCHANTS.keys()) + ['Gifts', 'Other']
+    budget = pd.DataFrame({'BUDGET': [400, 150, 50, 120, 60, 100, 500, 30, 100]}, index = pd.Index(categories, name = 'CATEGORIA'))
+    budget.to_excel(path.join(folderData, 'budget.xlsx'), sheet_name = 'Budget')
+
+def writeConfig(projectFolder, df, reporting_months = 0):
+    makedirs(path.join(projectFolder, 'src'), exist_ok = True)
+    first_date = pd.to_datetime(df['DATA'], dayfirst = True).min() - pd.Timedelta(days = 1)
+    with open(path.join(projectFolder, 'src', 'config.ini'), 'w') as configFile:
+        configFile.write(f"[PERIOD]\nreporting_months = {reporting_months}\n\n[EXPORT]\ntransactions_excel = false\n\n"
+                         f"[CUTOFF]\ndate = {first_date.date()}\ncash_amount = 5000")
+
+def generateProject(projectFolder, rows, seed = 0):
+    df = generateTransactions(rows, seed)
+
+    # Project folder: data/ListaMovimenti, taxonomies and configuration
+    makedirs(path.join(projectFolder, 'data'), exist_ok = True)
+    writeInbankCSV(df, path.join(projectFolder, 'data', f'ListaMovimentiCsv_{rows}.csv'))
+    writeTaxonomies(projectFolder, df)
+    writeConfig(projectFolder, df)
+    return df
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description = "Generate a synthetic Inbank export (ListaMovimenti CSV) with its taxonomies")
+    parser.add_argument('projectFolder')
+    parser.add_argument('--rows', type = int, default = 1000)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    generateProject(args.projectFolder, args.rows, args.seed)
+    print(f"--> Generated {args.rows} transactions in {args.projectFolder}")
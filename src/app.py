@@ -1,79 +1,284 @@
-from os import path, getcwd
-from pathlib import Path
-from locale import getlocale
+from os import path, getcwd, makedirs, listdir, stat
+from json import load, dump
 from datetime import datetime
-from win11toast import toast
+from argparse import ArgumentParser
 from configparser import ConfigParser
-from numpy import datetime64, timedelta64
-from threading import Thread
-from multiprocessing import Process
 
 # LOCAL IMPORTS
-from utils import dataLoader, stats
+from utils import tracing
 
-if __name__ == '__main__':
+# The heavy modules (pandas, matplotlib, xlsxwriter, ...) are imported only by the commands that need them
 
+def readConfig():
     config = ConfigParser()
     config.read(path.join('src','config.ini'))
-    reporting_period = int(config.get('PERIOD', 'reporting_months'))
+    return config
 
-    # Init folders
-    projectFolder = getcwd()
-    dataFolder, outputFolder, graphFolder = dataLoader.initFolders(projectFolder)
+def downloadFolder():
+    from pathlib import Path
+    from locale import getlocale
+    return path.join(Path.home(), "Download" if getlocale()[0].split('_')[0] == 'it' else "Downloads")
+
+def importMovements(projectFolder, config, download = True):
+    from utils import dataLoader
 
     # Import transaction file
-    importPath = path.join(Path.home(), "Download" if getlocale()[0].split('_')[0] == 'it' else "Downloads") 
-    importedFileName = dataLoader.importCSVTransactions(projectFolder, importPath)
+    importedFileName = None
+    if download:
+        importedFiles = dataLoader.importCSVTransactions(projectFolder, downloadFolder())
+        importedFileName = max(importedFiles) if importedFiles else None
 
     # Read movements
-    df = dataLoader.loadTransactions(projectFolder)
-    
-    # Select the first and last date
-    last_day, first_day =  df['VALUTA'].iloc[0], df['VALUTA'].iloc[-1]
-    days_ago, hours_ago, *_ = (datetime.now() - last_day).components
-    last_transaction = df[['DESC', 'CATEGORIA', 'IMPORTO']].iloc[0].astype('str').to_dict()
+    export_excel = config.getboolean('EXPORT', 'transactions_excel', fallback = True)
+    df = dataLoader.loadTransactions(projectFolder, exportExcel = export_excel)
+    return df, importedFileName, saveStatus(projectFolder, df)
+
+def saveStatus(projectFolder, df):
+
+    # Save the first and last transaction (read by the status command)
+    status = {'last_day': df['VALUTA'].iloc[0].isoformat(), 'first_day': df['VALUTA'].iloc[-1].isoformat(), 'transactions': len(df),
+              'last_transaction': {'DESC': str(df['DESC'].iloc[0]), 'CATEGORIA': str(df['CATEGORIA'].iloc[0]), 'IMPORTO': str(df['IMPORTO'].iloc[0] / 100)}}
+    with open(path.join(projectFolder, 'data', 'status.json'), 'w') as jsonFile:
+        dump(status, jsonFile, indent = 4)
+    return status
+
+def printStatus(status):
+    last_day, first_day = datetime.fromisoformat(status['last_day']), datetime.fromisoformat(status['first_day'])
+    delta = datetime.now() - last_day
+    days_ago, hours_ago = delta.days, delta.seconds // 3600
     print("\n--> LAST: ", last_day.strftime('%d-%m-%Y'),f'({days_ago} days and {hours_ago} hours ago)',
           "\n--> FIRST:", first_day.strftime('%d-%m-%Y'), "\n")
+    return days_ago, hours_ago
 
-    if importedFileName:
-        transactions_date = importedFileName.split('_')[:3]
-        transactions_date[0] = transactions_date[0][-2:]
-        tost_message = [f"Imported transaction up to {'-'.join(transactions_date)}"]
-    else:
-    
-        tost_message = ['The expensives have been analyzsed']
-    tost_message.append(f"Last Transaction was {days_ago} days and {hours_ago} hours ago "\
-                            f"({last_transaction['DESC']} - {last_transaction['CATEGORIA']}, {last_transaction['IMPORTO']} €).")
+def buildReports(projectFolder, df, config, workbooks = True, graphs = True, cube = None, pool = None):
+    from numpy import datetime64, timedelta64
+    from utils import dataLoader, stats, store
+    from utils.scheduler import Scheduler, Shared
+
+    reporting_period = int(config.get('PERIOD', 'reporting_months'))
+    dataFolder, outputFolder, graphFolder = dataLoader.initFolders(projectFolder)
+
+    # Aggregate the transactions (all the reports are generated from the cube)
+    if cube is None:
+        cube = stats.build_cube(df)
+    store.writeCube(path.join(dataFolder, 'cube.parquet'), cube)
+
+    # Report stages (the workers read the cubes from shared memory-mapped files, the unchanged outputs are not rebuilt)
+    scheduler = Scheduler(path.join(dataFolder, 'shared'), manifestFile = path.join(dataFolder, 'manifest.json'), pool = pool)
+    scheduler.share('cube', cube)
+    budgetFile = path.join(projectFolder, 'taxonomies', 'budget.xlsx')
 
     # Compute monthly stats
-    Thread(target = stats.monthly_stats, args=(df, outputFolder)).start()
+    if workbooks:
+        scheduler.add('monthly stats', stats.monthly_stats, args = (Shared('cube'), outputFolder, path.join(dataFolder, 'balances.parquet')),
+                      inputs = [path.join('src', 'config.ini')], outputs = [path.join(outputFolder, 'monthlyStats.xlsx')])
 
     # Consider only the selected period
     if reporting_period > 0:
         cutOff = datetime64('today', 'M')  - timedelta64(reporting_period, 'M')
-        df = df[df['VALUTA'].dt.to_period('M') > str(cutOff)]
+        cube = stats.period_slice(cube, first = str(cutOff + 1))
 
-        if df.empty:
+        if cube.empty:
             print(f"NO TRANSACTION IN THE LAST {reporting_period} MONTHS")
-            exit()
-        print(f"REPORTING PERIOD: {reporting_period} months\nCUTOFF: {cutOff} ({df['VALUTA'].iloc[-1].date()} <--> {df['VALUTA'].iloc[0].date()})\n")
+            scheduler.run()
+            return False
+        print(f"REPORTING PERIOD: {reporting_period} months\nCUTOFF: {cutOff} ({cube['MESE'].min()} <--> {cube['MESE'].max()})\n")
+    scheduler.share('reporting cube', cube)
+
+    if workbooks:
 
-    # Compute income stats
-    Thread(target= stats.compute_incomes, args=(df, outputFolder)).start()
-    
-    # Compute expensive by ABI code
-    threads = [Thread(target = stats.group_expensive, args=(df, outputFolder, feature, False)) for feature in ["CAUSALE ABI", "CATEGORIA"]]
-    [thread.start() for thread in threads]
+        # Compute income stats
+        scheduler.add('incomes', stats.compute_incomes, args = (Shared('reporting cube'), outputFolder),
+                      outputs = [path.join(outputFolder, 'incomes.xlsx')])
+
+        # Compute expensive by ABI code
+        for feature, fileName in [("CAUSALE ABI", 'expensivesbyAbiCode.xlsx'), ("CATEGORIA", 'expensives.xlsx')]:
+            scheduler.add(f'expensives by {feature}', stats.group_expensive, 
+                          args = (Shared('reporting cube'), outputFolder, feature, False, path.join(dataFolder, fileName.replace('.xlsx', '.pickle'))),
+                          inputs = [budgetFile], outputs = [path.join(outputFolder, fileName)])
 
     # Create the area graphs
-    processes = [Process(target = stats.expensive_graph, args=(df, graphFolder, period, "CATEGORIA"), daemon=True) 
-                 for period in ["MESE", "TRIMESTRE"]]
-    processes.append(Process(target =  stats.expensive_graph, args=(df, graphFolder, 'TRIMESTRE', "CAUSALE ABI"), daemon=True))
-    [process.start() for process in processes]
+    if graphs:
+        scheduler.add('graphs', stats.expensive_graphs, args = (Shared('reporting cube'), graphFolder), inputs = [budgetFile],
+                      outputs = [path.join(graphFolder, fileName) for fileName in ['expensivesByMonth.png', 'expensivesByQuarters.png', 'expensivesByQuartersAbiCauses.png']])
+
+    # Wait for all the outputs
+    scheduler.run()
+    return True
+
+def watch(projectFolder, interval = 5):
+    from time import sleep
+    from concurrent.futures import ProcessPoolExecutor
+    from utils import dataLoader, stats, taxonomy
+
+    importPath = downloadFolder()
+    taxonomyFolder = path.join(projectFolder, 'taxonomies')
+
+    # Resident state: the categorized transactions, their cube and the report workers (kept warm between the updates)
+    config = readConfig()
+    df, _, status = importMovements(projectFolder, config)
+    cube = stats.build_cube(df)
+    signature = taxonomy.sourcesSignature(taxonomyFolder)
+    reload = False
+    printStatus(status)
+
+    with ProcessPoolExecutor() as pool:
+        buildReports(projectFolder, df, config, cube = cube, pool = pool)
+        print(f"[WATCH] Waiting for new exports in {importPath} (every {interval} s, CTRL+C to stop)\n")
+
+        polled = dict()
+        while True:
+            sleep(interval)
+
+            # Exports whose size and modification time have not changed since the last poll (the download is completed)
+            exports = dict()
+            if path.exists(importPath):
+                for fileName in listdir(importPath):
+                    if fileName.endswith('.csv') and 'listamovimenti' in fileName.lower():
+                        fileStat = stat(path.join(importPath, fileName))
+                        exports[fileName] = (fileStat.st_size, fileStat.st_mtime)
+            ready = [fileName for fileName, fileStat in exports.items() if polled.get(fileName) == fileStat]
+            polled = exports
+
+            # Retry a failed update only with new exports or taxonomies (not at every poll)
+            taxonomyChanged = taxonomy.sourcesSignature(taxonomyFolder) != signature
+            if len(ready) == 0 and not taxonomyChanged:
+                continue
+
+            try:
+                config = readConfig()
+                export_excel = config.getboolean('EXPORT', 'transactions_excel', fallback = True)
+
+                # The categories of the whole history depend on the taxonomies (a failed update also reloads the whole history)
+                if taxonomyChanged or reload:
+                    print("[WATCH] " + ("The taxonomies have changed" if taxonomyChanged else "Retrying after the last error") + ": reloading the transactions\n")
+                    signature = taxonomy.sourcesSignature(taxonomyFolder)
+                    df, _, status = importMovements(projectFolder, config)
+                    cube = stats.build_cube(df)
+                    reload = False
+
+                # Fold the new transactions into the loaded ones
+                else:
+                    dataLoader.importCSVTransactions(projectFolder, importPath, ready)
+                    df, new_df = dataLoader.foldTransactions(projectFolder, df, exportExcel = export_excel)
+                    print(f"[WATCH] {len(new_df)} new transactions\n")
+                    if len(new_df) == 0:
+                        continue
+                    cube = stats.merge_cubes(cube, stats.build_cube(new_df))
+                    status = saveStatus(projectFolder, df)
+
+                printStatus(status)
+                buildReports(projectFolder, df, config, cube = cube, pool = pool)
+
+            # Keep watching (the next update reloads the whole history)
+            except Exception as error:
+                print(f"[ERROR] {error!r}\n")
+                reload = True
+
+def suggest(projectFolder, df, limit = 20):
+    from pandas import option_context
+    from utils import stats, suggestions
+
+    # Likely category and keyword (to add to expensiveCategories.json) of the largest "Other" expenses
+    suggested = suggestions.suggestCategories(suggestions.readIndex(path.join(projectFolder, 'data')), stats.build_cube(df))
+    if suggested.empty:
+        print("--> No \"Other\" expenses\n")
+        return suggested
+    with option_context('display.max_colwidth', 60, 'display.width', 250):
+        print(suggested.head(limit).to_string(index = False), "\n")
+    print(f"--> {suggested['SUGGERIMENTO'].notna().sum()}/{len(suggested)} \"Other\" descriptions with a suggestion\n")
+    return suggested
+
+def notify(projectFolder, importedFileName, status, days_ago, hours_ago):
+    from win11toast import toast
+
+    if importedFileName:
+        transactions_date = importedFileName.split('_')[:3]
+        transactions_date[0] = transactions_date[0][-2:]
+        tost_message = [f"Imported transaction up to {'-'.join(transactions_date)}"]
+    else:
+
+        tost_message = ['The expensives have been analyzsed']
+    last_transaction = status['last_transaction']
+    tost_message.append(f"Last Transaction was {days_ago} days and {hours_ago} hours ago "\
+                            f"({last_transaction['DESC']} - {last_transaction['CATEGORIA']}, {last_transaction['IMPORTO']} €).")
 
     # Window Message
     items = {'Expensives':  path.join(projectFolder, 'outputs', 'expensives.xlsx'),
              'Month Graph':  path.join(projectFolder, 'outputs', 'graphs', 'expensivesByMonth.png'),
              'Quarter Graph':  path.join(projectFolder, 'outputs', 'graphs', 'expensivesByQuarters.png')}
     toast(*tost_message, icon = path.join(projectFolder, 'images', 'inbank.ico'), audio = {'silent': 'true'}, duration='long',
-          buttons = [{'activationType': 'protocol', 'arguments':path, 'content': title} for title, path in items.items()])
\ No newline at end of file
+          buttons = [{'activationType': 'protocol', 'arguments':path, 'content': title} for title, path in items.items()])
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description = "Expensive analyzer (without a command: import, reports, graphs and notification)")
+    commands = parser.add_subparsers(dest = 'command')
+    commands.add_parser('import', help = "Import the new movements into the transaction store")
+    commands.add_parser('report', help = "Generate the excel reports")
+    commands.add_parser('graphs', help = "Generate the graphs")
+    commands.add_parser('status', help = "Show the first and last transaction")
+    watchCommand = commands.add_parser('watch', help = "Stay open and update the reports whenever a new export is downloaded")
+    watchCommand.add_argument('--interval', type = float, default = 5, help = "Seconds between two checks of the download folder")
+    suggestCommand = commands.add_parser('suggest', help = "Suggest the categories (and keywords) of the \"Other\" expenses")
+    suggestCommand.add_argument('--limit', type = int, default = 20, help = "Number of descriptions to show (largest expenses first)")
+    serveCommand = commands.add_parser('serve', help = "Answer JSON queries (spend, top descriptions, budget variance) on a local HTTP port")
+    serveCommand.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--trace', action = 'store_true', help = "Save the spans of each stage (wall time, CPU time, peak memory) in outputs/trace.json")
+    parser.add_argument('--profile', metavar = 'STAGE', help = "Profile a stage with cProfile, e.g. group_expensive (all its calls are merged in outputs/<STAGE>.prof)")
+    arguments = parser.parse_args()
+    command = arguments.command
+
+    projectFolder = getcwd()
+    makedirs(path.join(projectFolder, 'data'), exist_ok = True)
+
+    # Last import (no data library is loaded)
+    if command == 'status':
+        statusFile = path.join(projectFolder, 'data', 'status.json')
+        if not path.exists(statusFile):
+            exit("No transactions imported yet! Run the import command first.")
+        with open(statusFile) as jsonFile:
+            status = load(jsonFile)
+        printStatus(status)
+        print("--> TRANSACTIONS:", status['transactions'])
+        last_transaction = status['last_transaction']
+        print(f"--> LAST TRANSACTION: {last_transaction['DESC']} - {last_transaction['CATEGORIA']}, {last_transaction['IMPORTO']} €\n")
+        exit()
+
+    # Instrumentation (Chrome trace, it can be opened with chrome://tracing or ui.perfetto.dev)
+    if arguments.trace or arguments.profile:
+        tracing.enable(path.join(projectFolder, 'outputs', 'trace.json'), arguments.profile)
+
+    try:
+        if command == 'serve':
+            from utils import api
+            try:
+                api.serve(projectFolder, port = arguments.port)
+            except KeyboardInterrupt:
+                print("\n[API] Stopped")
+            exit()
+
+        if command == 'watch':
+            try:
+                watch(projectFolder, arguments.interval)
+            except KeyboardInterrupt:
+                print("\n[WATCH] Stopped")
+            exit()
+
+        config = readConfig()
+        df, importedFileName, status = importMovements(projectFolder, config, download = command in [None, 'import'])
+        days_ago, hours_ago = printStatus(status)
+        if command == 'import':
+            exit()
+        if command == 'suggest':
+            suggest(projectFolder, df, arguments.limit)
+            exit()
+
+        # Reports
+        completed = buildReports(projectFolder, df, config, workbooks = command in [None, 'report'], graphs = command in [None, 'graphs'])
+        if completed and command is None:
+            notify(projectFolder, importedFileName, status, days_ago, hours_ago)
+    finally:
+        traceFile = tracing.writeTrace()
+        if traceFile:
+            print("--> Trace:", traceFile, "\n")
@@ -0,0 +1,202 @@
+from os import path
+from re import fullmatch
+from json import dumps, load
+from functools import lru_cache
+from threading import Lock
+from urllib.parse import urlparse, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+
+# LOCAL IMPORTS
+from utils import budgets, dataLoader, stats, store, suggestions, taxonomy
+
+# Features that can be used to group the expenses
+FEATURES = ['CATEGORIA', 'CAUSALE ABI', 'MACRO-CATEGORIA']
+
+# Periods of the queries: dates, months, quarters or years (pandas would also read "March" as the year 1)
+PERIOD_PATTERN = r'\d{4}(-\d{2}(-\d{2})?|Q[1-4])?'
+
+class SpendingQueries:
+
+    # Read-only queries over the cube (the amounts are in euros, the expenses are positive)
+    def __init__(self, cube, budget = None, status = None, index = None):
+        self.cube = cube
+        self.index = index if index is not None else suggestions.countTokens(pd.DataFrame(columns = suggestions.POSTING_COLUMNS))
+        self.budget = budget if budget is not None else pd.DataFrame(columns = budgets.BUDGET_COLUMNS)
+        self.status = status or dict()
+        self.first, self.last = (cube['MESE'].min(), cube['MESE'].max()) if len(cube) > 0 else (None, None)
+
+        # Answers already computed (discarded with the object when the data is reloaded)
+        self.answer = lru_cache(maxsize = 512)(self._answer)
+
+    def period(self, params):
+        try:
+            if not all(fullmatch(PERIOD_PATTERN, params[key]) for key in ('from', 'to') if params.get(key)):
+                raise ValueError
+            first = pd.Period(params['from']).asfreq('M', 'start') if params.get('from') else self.first
+            last = pd.Period(params['to']).asfreq('M', 'end') if params.get('to') else self.last
+        except ValueError:
+            raise ValueError("The periods must be dates, months, quarters or years (e.g. 2024-03-15, 2024-03, 2024Q1, 2024)")
+        if first is not None and last is not None and first > last:
+            raise ValueError(f"The period starts after its end ({first} > {last})")
+        return first, last
+
+    def count(self, params, default = 10):
+        try:
+            n = int(params.get('n', default))
+        except ValueError:
+            n = 0
+        if n <= 0:
+            raise ValueError(f"The number of items must be a positive integer (n={params.get('n')})")
+        return n
+
+    def expenses(self, first, last):
+        cube = stats.period_slice(self.cube, first, last)
+        return cube[cube['SEGNO'] < 0]
+
+    def spend(self, params):
+        feature = params.get('by', 'CATEGORIA')
+        if feature not in FEATURES:
+            raise ValueError(f"Unknown feature: {feature} (available: {', '.join(FEATURES)})")
+
+        # Total and count of the expenses of each group
+        first, last = self.period(params)
+        grouped = self.expenses(first, last).groupby(by = feature, observed = True)[['IMPORTO', '#']].sum().sort_values(by = 'IMPORTO')
+        items = [{'name': name, 'amount': -cents / 100, 'transactions': int(count)} for name, cents, count in grouped.itertuples()]
+        return {'from': str(first), 'to': str(last), 'by': feature, 'total': -int(grouped['IMPORTO'].sum()) / 100, 'items': items}
+
+    def top(self, params):
+        first, last = self.period(params)
+        expenses = self.expenses(first, last)
+        if params.get('category'):
+            expenses = expenses[expenses['CATEGORIA'] == params['category']]
+
+        # Descriptions with the highest expenses
+        grouped = expenses.groupby(by = 'DESC', observed = True)[['IMPORTO', '#']].sum().sort_values(by = ['IMPORTO', '#'], ascending = [True, False])
+        grouped = grouped.head(self.count(params))
+        items = [{'description': name, 'amount': -cents / 100, 'transactions': int(count)} for name, cents, count in grouped.itertuples()]
+        return {'from': str(first), 'to': str(last), 'category': params.get('category'), 'items': items}
+
+    def variance(self, params):
+        first, last = self.period(params)
+        months = (last - first).n + 1 if first is not None else 0
+
+        # Expenses of each category compared with the monthly budgets effective over the period
+        spent = self.expenses(first, last).groupby(by = 'CATEGORIA', observed = True)['IMPORTO'].sum() / -100
+        categories = budgets.budgetCategories(self.budget)
+        totals = budgets.rangeBudgets(self.budget, first, last, categories) if months > 0 else pd.Series(0.0, index = categories)
+        items = []
+        for category, budget in totals.items():
+            budget = int(budget)
+            amount = float(spent.get(category, 0))
+            items.append({'category': category, 'amount': amount, 'budget': budget, 'delta': round(amount - budget, 2),
+                          'delta_pct': round((amount - budget) / budget, 4) if budget > 0 else None})
+        unbudgeted = sorted(set(spent.index) - set(categories))
+        return {'from': str(first), 'to': str(last), 'months': months, 'items': sorted(items, key = lambda item: -item['delta']),
+                'unbudgeted': unbudgeted}
+
+    def months(self, params):
+        first, last = self.period(params)
+        cube = stats.period_slice(self.cube, first, last)
+
+        # Incomes, expenses and investments of each month
+        monthly = cube.pivot_table(index = 'MESE', columns = 'MACRO-CATEGORIA', values = 'IMPORTO', aggfunc = 'sum', fill_value = 0) / 100
+        return {'from': str(first), 'to': str(last),
+                'items': [{'month': str(month), **{col: float(value) for col, value in row.items()}} for month, row in monthly.iterrows()]}
+
+    def suggest(self, params):
+
+        # Likely categories and keywords of the largest "Other" expenses
+        n = self.count(params, default = 20)
+        suggested = suggestions.suggestCategories(self.index, self.cube).head(n)
+        suggested = suggested.astype('object').where(suggested.notna(), None)
+        items = [{'description': desc, 'amount': amount, 'transactions': int(count), 'category': category, 'score': score,
+                  'keyword': keyword, 'ranking': ranking} for desc, amount, count, category, score, keyword, ranking in suggested.itertuples(index = False)]
+        return {'items': items}
+
+    def _answer(self, endpoint, query):
+        handlers = {'/spend': self.spend, '/top': self.top, '/budget': self.variance, '/months': self.months, '/suggest': self.suggest,
+                    '/status': lambda params: self.status}
+        if endpoint not in handlers:
+            raise LookupError(f"Unknown endpoint: {endpoint} (available: {', '.join(handlers.keys())})")
+        return dumps(handlers[endpoint](dict(query)), default = str).encode('UTF-8')
+
+def loadCube(projectFolder):
+    dataFolder = path.join(projectFolder, 'data')
+    folderData = path.join(projectFolder, 'taxonomies')
+
+    # Cube saved by the last reports (unless an import or a taxonomy change is more recent)
+    cubeFile = path.join(dataFolder, 'cube.parquet')
+    sources = [path.join(dataFolder, 'status.json')] + [path.join(folderData, fileName) for fileName in taxonomy.TAXONOMY_FILES]
+    if path.exists(cubeFile) and path.getmtime(cubeFile) >= max([path.getmtime(source) for source in sources if path.exists(source)], default = 0):
+        return store.readCube(cubeFile)
+
+    # Categorized history (the store and the memo are only read, no export is imported)
+    df = store.readTransactions(path.join(dataFolder, 'transactions'))
+    if len(df) == 0:
+        raise Exception('No data! Run the import command first.\n')
+    df = dataLoader.describeTransactions(df, folderData = folderData, memoFile = path.join(dataFolder, 'descriptions.parquet'), readOnly = True)
+    return stats.build_cube(dataLoader.addPeriods(df))
+
+def loadQueries(projectFolder):
+    dataFolder = path.join(projectFolder, 'data')
+    folderData = path.join(projectFolder, 'taxonomies')
+    cube = loadCube(projectFolder)
+
+    status = dict()
+    if path.exists(path.join(dataFolder, 'status.json')):
+        with open(path.join(dataFolder, 'status.json')) as jsonFile:
+            status = load(jsonFile)
+    return SpendingQueries(cube, taxonomy.loadTaxonomies(folderData)['budget'], status, suggestions.readIndex(dataFolder))
+
+class SpendingService:
+
+    # Reload the data (and drop the cached answers) after each import or taxonomy change
+    def __init__(self, projectFolder):
+        self.projectFolder = projectFolder
+        self.lock = Lock()
+        self.signature = None
+        self.queries = None
+
+    def dataSignature(self):
+        statusFile = path.join(self.projectFolder, 'data', 'status.json')
+        return (path.getmtime(statusFile) if path.exists(statusFile) else None,
+                taxonomy.sourcesSignature(path.join(self.projectFolder, 'taxonomies')))
+
+    def current(self):
+        signature = self.dataSignature()
+        with self.lock:
+            if signature != self.signature:
+                self.queries = loadQueries(self.projectFolder)
+                self.signature = signature
+            return self.queries
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            body, code = self.server.service.current().answer(url.path.rstrip('/') or '/status', tuple(sorted(parse_qsl(url.query)))), 200
+        except LookupError as error:
+            body, code = dumps({'error': str(error)}).encode('UTF-8'), 404
+        except ValueError as error:
+            body, code = dumps({'error': str(error)}).encode('UTF-8'), 400
+        except Exception as error:
+            body, code = dumps({'error': f"{type(error).__name__}: {error}".strip()}).encode('UTF-8'), 500
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(projectFolder, host = '127.0.0.1', port = 8765):
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = SpendingService(projectFolder)
+    server.service.current()
+    print(f"[API] http://{host}:{port} (/spend, /top, /budget, /months, /suggest, /status)\n")
+    with server:
+        server.serve_forever()
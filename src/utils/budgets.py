@@ -0,0 +1,73 @@
+from os import path
+import numpy as np
+import pandas as pd
+
+# Monthly budget of each category (DAL: optional first month of the amount, the first amount of a category also covers the previous months)
+BUDGET_COLUMNS = ['CATEGORIA', 'DAL', 'BUDGET']
+
+def readBudget(folderData):
+    budget = pd.read_excel(path.join(folderData, 'budget.xlsx'), sheet_name = 'Budget')
+    budget = budget.rename(columns = {budget.columns[0]: 'CATEGORIA'})
+    if 'DAL' not in budget.columns:
+        budget['DAL'] = None
+    budget = budget[BUDGET_COLUMNS].dropna(subset = ['CATEGORIA'])
+
+    if budget['BUDGET'].isna().any():
+        raise Exception(f"Missing budget for: {', '.join(budget.loc[budget['BUDGET'].isna(), 'CATEGORIA'].astype(str))}\n")
+    try:
+        budget['DAL'] = pd.PeriodIndex(pd.to_datetime(budget['DAL'].astype('str').where(budget['DAL'].notna())), freq = 'M')
+    except (ValueError, TypeError) as error:
+        raise Exception(f"Invalid effective-from month (DAL) in the budget: {error}\n")
+
+    budget = budget.astype({'CATEGORIA': 'str', 'BUDGET': 'int64'})
+    duplicated = budget.duplicated(subset = ['CATEGORIA', 'DAL'])
+    if duplicated.any():
+        raise Exception(f"Duplicated budget for: {', '.join(budget.loc[duplicated, 'CATEGORIA'].unique())}\n")
+    return budget.sort_values(by = ['CATEGORIA', 'DAL'], na_position = 'first').reset_index(drop = True)
+
+def budgetCategories(budget):
+    return budget['CATEGORIA'].unique().tolist()
+
+def monthlyBudgets(budget, categories, months):
+
+    # Amount of each (category, month) pair effective in the month: as-of join on the month ordinals
+    left = pd.DataFrame({'CATEGORIA': np.asarray(categories, dtype = 'object').astype('str'), 'ORDINAL': np.asarray(months, dtype = 'int64')})
+    left['ROW'] = np.arange(len(left))
+    right = budget.assign(ORDINAL = budget['DAL'].array.asi8)
+    right.loc[~right['CATEGORIA'].duplicated(), 'ORDINAL'] = np.iinfo('int64').min
+    merged = pd.merge_asof(left.sort_values(by = 'ORDINAL', kind = 'stable'), right.sort_values(by = 'ORDINAL', kind = 'stable')[['CATEGORIA', 'ORDINAL', 'BUDGET']],
+                           on = 'ORDINAL', by = 'CATEGORIA', direction = 'backward')
+
+    # Categories without a budget would fail the comparison
+    missing = merged.loc[merged['BUDGET'].isna(), 'CATEGORIA'].unique()
+    if len(missing) > 0:
+        raise Exception(f"\n{', '.join(sorted(missing))} is not in the budget! Please include it in the budget file.\n")
+    return merged.sort_values(by = 'ROW')['BUDGET'].to_numpy(dtype = 'float')
+
+def periodBudgets(budget, categories, periods):
+
+    # Sum of the monthly budgets of the months in each period (e.g. quarters)
+    periods = pd.PeriodIndex(periods)
+    if len(periods) == 0:
+        return np.array([], dtype = 'float')
+    starts, stops = periods.asfreq('M', 'start').asi8, periods.asfreq('M', 'end').asi8 + 1
+    counts = stops - starts
+    firstRows = np.cumsum(counts) - counts
+    months = np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(firstRows, counts)
+    monthly = monthlyBudgets(budget, np.repeat(np.asarray(categories, dtype = 'object'), counts), months)
+    return np.add.reduceat(monthly, firstRows)
+
+def rangeBudgets(budget, first, last, categories = None):
+
+    # Total budget of each category between two months
+    categories = categories if categories is not None else budgetCategories(budget)
+    months = np.arange(pd.Period(first, 'M').ordinal, pd.Period(last, 'M').ordinal + 1)
+    monthly = monthlyBudgets(budget, np.repeat(np.asarray(categories, dtype = 'object'), len(months)), np.tile(months, len(categories)))
+    return pd.Series(monthly.reshape(len(categories), len(months)).sum(axis = 1), index = categories)
+
+def variance(amounts, budgets):
+
+    # Expenses (negative amounts) over the budget, in euros and relative to the budget (9.99 without a budget)
+    delta = np.round(-np.asarray(amounts, dtype = 'float') - budgets, 0)
+    ratio = np.divide(delta, budgets, out = np.full(len(delta), 9.99), where = budgets > 0)
+    return delta, ratio
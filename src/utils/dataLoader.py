@@ -1,10 +1,16 @@
-from os import path, listdir, remove, makedirs
-from json import load
-from hashlib import md5
-from pandas.io.formats.excel import ExcelFormatter
+from os import path, listdir, remove, makedirs, cpu_count
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import numpy as np
 import pandas as pd
 import shutil
 
+# LOCAL IMPORTS
+from utils import store, manifest, taxonomy, tracing, suggestions
+
+# Total size of the exports above which they are parsed by a process pool (about 25 ms per MB on a single core)
+PARALLEL_PARSE_BYTES = 32 * 2**20
+
 def initFolders(projectFolder):
     dataFolder = path.join(projectFolder, 'data')
     if not path.exists(dataFolder):
@@ -17,163 +23,207 @@ def initFolders(projectFolder):
 
     return dataFolder, outputFolder, graphFolder
 
-def importCSVTransactions(projectFolder, importPath):
+def importCSVTransactions(projectFolder, importPath, fileNames = None):
     if not path.exists(importPath):
         print(f"\n[WARNING] The import path does not exist! {importPath} --> (A) Change che import path in the app.py file.--> (B) Put the file into the ./data folder.\n")
         return False
 
-    for fileName in listdir(importPath):
+    # Move all the exports (e.g. a backfill of several months)
+    importedFiles = []
+    for fileName in sorted(fileNames if fileNames is not None else listdir(importPath)):
         if  fileName.endswith('.csv') and 'listamovimenti' in fileName.lower():
             try:
                 shutil.move(src = path.join(importPath, fileName), dst = path.join(projectFolder, 'data'))
                 print("--> Imported file:", fileName, "\n")
-                return fileName
+                importedFiles.append(fileName)
             except shutil.Error:
-                return None
-    return None
+                print(f"[WARNING] {fileName} is already in the data folder\n")
+    return importedFiles
 
-def loadTransactions(projectFolder):
+@tracing.traced
+def loadTransactions(projectFolder, exportExcel = True):
 
     outputfileName = 'Transactions.xlsx'
-
-    # Attach new transactions
-    df = importTransactions(projectFolder)
-    
-    # Import the main dataframe
     dataFolder = path.join(projectFolder, 'data')
-    
-    folderFiles = listdir(dataFolder)
-    if outputfileName in folderFiles:
+    storeFolder = path.join(dataFolder, 'transactions')
 
-        # Load the excel file
-        main_df = pd.read_excel(path.join(dataFolder, outputfileName), sheet_name='Transactions') 
-        main_df['ID'] = main_df['DESCRIZIONE OPERAZIONE'].map(lambda desc: md5(desc.encode('UTF-8')).hexdigest())
+    # Migrate the legacy excel file into the columnar store
+    if not store.storeExists(storeFolder) and outputfileName in listdir(dataFolder):
+        legacy_df = pd.read_excel(path.join(dataFolder, outputfileName), sheet_name='Transactions') 
+        legacy_df['ID'] = store.transactionIDs(legacy_df['DESCRIZIONE OPERAZIONE'])
+        store.appendTransactions(storeFolder, legacy_df)
+        print("--> Migrated", outputfileName, "into the transaction store\n")
+    elif store.migrateStore(storeFolder):
+        print("--> Migrated the transaction store to the compact schema (amounts in cents)\n")
 
-        # Upload the categories
-        main_df = addExpensiveCategories(main_df, folderData = path.join(projectFolder, 'taxonomies'))
+    # Attach new transactions
+    df = importTransactions(projectFolder)
+    if len(df) > 0:
+        appended = store.appendTransactions(storeFolder, df)
+        print(f"--> Stored {appended} new transactions\n")
 
-        # Merge the dataframes
-        df = pd.concat([main_df, df]).drop_duplicates(subset=['VALUTA', 'IMPORTO']).reset_index(drop = True)
+    removeImportedFiles(dataFolder)
 
+    # Load the whole history and upload the categories
+    df = store.readTransactions(storeFolder)
     if len(df) == 0:
         raise Exception('No data! Neither in the DATA folder nor in the DOWNLOAD folder.\n')
+    df = describeTransactions(df, folderData = path.join(projectFolder, 'taxonomies'), memoFile = path.join(dataFolder, 'descriptions.parquet'), 
+                              reportUnknown = True)
     
     # Sort the new dataframe
-    df = df.sort_values(by = ['VALUTA', 'DATA'], ascending = False)
+    df = df.sort_values(by = ['VALUTA', 'DATA'], ascending = False).reset_index(drop = True)
+    df = addPeriods(df)
+
+    if exportExcel:
+        updateTransactionsExport(df, dataFolder)
+    return df
+
+@tracing.traced
+def foldTransactions(projectFolder, df, exportExcel = True):
+
+    dataFolder = path.join(projectFolder, 'data')
+    storeFolder = path.join(dataFolder, 'transactions')
+
+    # Parse and describe only the new exports (the history is already loaded)
+    new_df = importTransactions(projectFolder)
+    removeImportedFiles(dataFolder)
+    if len(new_df) == 0:
+        return df, new_df
+
+    # Keep the transactions not loaded yet
+    new_df = new_df.drop_duplicates(subset = ['VALUTA', 'IMPORTO'])
+    isKnown = pd.MultiIndex.from_frame(new_df[['VALUTA', 'IMPORTO']]).isin(pd.MultiIndex.from_frame(df[['VALUTA', 'IMPORTO']]))
+    new_df = new_df[~isKnown]
+    if len(new_df) == 0:
+        return df, new_df
+    store.appendTransactions(storeFolder, new_df)
+
+    # Attach them to the loaded transactions
+    new_df = addPeriods(new_df[store.STORE_COLUMNS].copy())
+    df = store.concatTransactions([df, new_df]).sort_values(by = ['VALUTA', 'DATA'], ascending = False).reset_index(drop = True)
+
+    if exportExcel:
+        updateTransactionsExport(df, dataFolder)
+    return df, new_df
+
+def removeImportedFiles(dataFolder):
+    for fileName in listdir(dataFolder):
+        if fileName.endswith('.csv'):
+            remove(path.join(dataFolder, fileName))
+
+def addPeriods(df):
 
     # Create the month column 
     df['MESE'] = df['VALUTA'].dt.to_period('M') #.strftime('%B %Y')
     df['TRIMESTRE'] = df['VALUTA'].dt.to_period('Q')
-    df['ANNO'] = df['VALUTA'].dt.to_period('Y').dt.year
+    df['ANNO'] = df['VALUTA'].dt.year.astype('int16')
+    return df
+
+def updateTransactionsExport(df, dataFolder, outputfileName = 'Transactions.xlsx'):
+
+    # Export the excel file (unless the transactions have not changed since the last export)
+    manifestFile = path.join(dataFolder, 'manifest.json')
+    fingerprint = manifest.frameFingerprint(df)
+    if not manifest.isUpToDate(manifest.readManifest(manifestFile), outputfileName, fingerprint, [path.join(dataFolder, outputfileName)]):
+        exportTransactions(df, path.join(dataFolder, outputfileName))
+        manifest.updateManifest(manifestFile, {outputfileName: fingerprint})
 
-    # Erase the folder 
-    for fileName in folderFiles:
-       file_path = path.join(dataFolder, fileName)
-       if path.isfile(file_path):
-           remove(file_path)
+@tracing.traced
+def exportTransactions(df, filePath):
+    from utils.reportWriter import ReportWriter # xlsxwriter is imported only to write the workbooks
+
+    # Graphical settings
+    header_format = {'bg_color': '#9DBC98', 'font_color': 'white', 'bold': False, 'valign': 'center'}
+    grey_format = {'bg_color': '#EEEEEE'}
 
     # Save the dataframe
-    ExcelFormatter.header_style = None
-    with pd.ExcelWriter(path.join(dataFolder, outputfileName),  engine = 'xlsxwriter', datetime_format="d mmm yyyy") as excelFile:
-        
-        # Main
-        df.drop(columns = ['ID']).to_excel(excelFile, index = False, sheet_name = 'Transactions', freeze_panes = (1,0))
+    with ReportWriter(filePath, dateFormat = "d mmm yyyy") as report:
 
-        # IDs
-        columns = ['ID', 'VALUTA', 'CATEGORIA','IMPORTO' ,'DESCRIZIONE OPERAZIONE']
-        df[columns].to_excel(excelFile, index = False, sheet_name = 'IDs', freeze_panes = (1, 0))
-        
-        # Graphical settings
-        grey_format = excelFile.book.add_format({'bg_color': '#EEEEEE'})
-        white_format = excelFile.book.add_format({'bg_color': '#FFFFFF'})
-        header_format = excelFile.book.add_format({'bg_color': '#9DBC98', 'font_color': 'white', 'bold': False, 'valign': 'center'})
-   
-        for sheet in excelFile.sheets.values():
-            for idk_row in range(1, len(df)):
-                sheet.set_row(idk_row, cell_format = white_format if idk_row % 2 ==0 else grey_format)
-
-            sheet.set_row(0, None, header_format)
-            sheet.autofit()
+        # Main (hidden columns, custom width and autofilter)
+        transactions = df.drop(columns = ['ID']).assign(IMPORTO = df['IMPORTO'] / 100)
+        sheet = report.writeFrame('Transactions', transactions, index = False, header = header_format, freeze_panes = (1, 0),
+                                  columns = {'A:A': {'hidden': True}, 'C:C': {'hidden': True}, 'F:F': {'width': 50}})
+        sheet.autofilter(0, 0, len(transactions), len(transactions.columns) - 1)
 
         # Colorbar
-        excelFile.sheets['Transactions'].conditional_format('E2:E999', {
+        sheet.conditional_format(f'E2:E{len(transactions) + 1}', {
             'type': '3_color_scale', 'min_type': 'percentile', 'min_value': 5, 'min_color': "#FF8080", 
             'mid_color': "white", 'mid_type': 'num', 'mid_value': 0, 'max_color': "#99BC85"})
-        
-        # Hidden columns
-        for i in [0, 2]:
-            excelFile.sheets['Transactions'].set_column(first_col = i, last_col = i, options = {"hidden": True})
 
-        # Set custom width
-        #excelFile.sheets['Transactions'].set_column(first_col = 1, last_col = 1, width = 11)
-        excelFile.sheets['Transactions'].set_column(first_col = 5, last_col = 5, width = 50)
-        #excelFile.sheets['Transactions'].set_column(first_col = 10, last_col = 10, width = 10)
+        # IDs
+        columns = ['ID', 'VALUTA', 'CATEGORIA','IMPORTO' ,'DESCRIZIONE OPERAZIONE']
+        ids = df[columns].assign(ID = store.formatIDs(df['ID']).to_numpy(), IMPORTO = df['IMPORTO'] / 100)
+        report.writeFrame('IDs', ids, index = False, header = header_format, freeze_panes = (1, 0))
 
-        # Autofilter
-        excelFile.sheets['Transactions'].autofilter('A1:J9999')
+        # Alternate row colors
+        for sheet in report.book.worksheets():
+            sheet.conditional_format(1, 0, len(df), sheet.dim_colmax, {
+                'type': 'formula', 'criteria': "=MOD(ROW(),2)=0", 'format': report.style(grey_format)})
 
-    return df
+@tracing.traced
+def readCSVTransactions(filePath):
 
+    # Drop the footer row, so that the C parser can be used (skipfooter requires the python engine)
+    with open(filePath, 'rb') as csvFile:
+        content = csvFile.read().rstrip(b'\r\n')
+    content = content[:content.rfind(b'\n') + 1]
 
-def importTransactions(projectFolder):
+    return pd.read_csv(BytesIO(content), sep = ';', decimal = ',', thousands = '.', 
+                       dtype = {'DATA': 'str', 'VALUTA': 'str', 'DESCRIZIONE OPERAZIONE': 'str', 'DARE': 'float', 'AVERE': 'float'})
 
-    dataFolder = path.join(projectFolder, 'data')
-        
-    # Scan the folder
-    folderFiles = listdir(dataFolder)
-
-    dfs = []
-    for fileName in folderFiles:
-        if fileName.endswith('.csv'):
-          dfs.append(pd.read_csv(path.join(dataFolder, fileName), sep = ';', skipfooter = 1, parse_dates=['DATA', 'VALUTA'],  engine='python', dayfirst=True))
-    
-    if len(dfs) == 0: 
-        return pd.DataFrame()
-    df = pd.concat(dfs).drop_duplicates().reset_index(drop = True)
+@tracing.traced
+def parseCSVTransactions(filePath):
+    df = readCSVTransactions(filePath)
 
     # Drop the invalid entries
     df = df.dropna(subset = 'CAUSALE ABI')
-    df = df.dropna(axis=1, how='all')
     df = df.drop(columns= [col for col in df.columns if 'unnamed' in col.lower()])
 
     # Parse the data
     df['DATA'] = pd.to_datetime(df['DATA'], dayfirst=True)
     df['VALUTA'] = pd.to_datetime(df['VALUTA'], dayfirst=True)
     
-    # Generate the ID (M5 Hash) for each transaction
-    df['ID'] = df['DESCRIZIONE OPERAZIONE'].map(lambda desc: md5(desc.encode('UTF-8')).hexdigest())
+    # Signed amount in cents (DARE: outgoing, AVERE: incoming)
+    df['IMPORTO'] = store.toCents((-df['DARE']).fillna(df['AVERE']))
 
-    # Modify the numerical representation
-    for col in ['AVERE', 'DARE']:
-        cond = ~df[col].isna()
-        if cond.any():
-            df.loc[cond, col] = df.loc[cond, col].str.replace('.', '').str.replace(',', '.').astype('float')
+    # Remove the last empty column
+    df = df.drop(columns = ['DARE', 'AVERE'])
+    return df
 
-    #df['CAUSALE ABI'] = df['CAUSALE ABI'].astype(pd.Int32Dtype())
+@tracing.traced
+def importTransactions(projectFolder):
 
-    # Replace 
-    df['IMPORTO'] = df.apply(lambda df_row: df_row['AVERE'] if pd.isna(df_row['DARE']) else -df_row['DARE'], axis = 1)
+    dataFolder = path.join(projectFolder, 'data')
 
-    # Clean description
-    df['DESC'] = df['DESCRIZIONE OPERAZIONE'].map(cleanDescription)
-    df['DESC'] = df['DESC'].map(cleanIncomeDescription)
-    
-    # Remove the last empty column
-    df = df.drop(columns = ['DARE', 'AVERE'])
+    # Scan the folder
+    csvFiles = [path.join(dataFolder, fileName) for fileName in sorted(listdir(dataFolder)) if fileName.endswith('.csv')]
+    if len(csvFiles) == 0: 
+        return pd.DataFrame()
+
+    # Parse the exports in parallel only when they are large (e.g. a backfill of several years), 
+    # for the usual monthly exports the startup of the workers costs more than the parsing
+    if len(csvFiles) > 1 and cpu_count() > 1 and sum(path.getsize(filePath) for filePath in csvFiles) > PARALLEL_PARSE_BYTES:
+        with ProcessPoolExecutor(max_workers = min(len(csvFiles), cpu_count())) as pool:
+            parsed = list(pool.map(parseCSVTransactions, csvFiles))
+    else:
+        parsed = [parseCSVTransactions(filePath) for filePath in csvFiles]
+
+    df = pd.concat(parsed).drop_duplicates().reset_index(drop = True)
 
     # Map the ABI codes
     df = mapAbiCodes(df, folderData = path.join(projectFolder, 'taxonomies'))
 
-    # Map the categories
-    df = addExpensiveCategories(df, folderData = path.join(projectFolder, 'taxonomies'))
+    # Generate the ID, the clean description and the categories (compact schema)
+    df = describeTransactions(df, folderData = path.join(projectFolder, 'taxonomies'), memoFile = path.join(dataFolder, 'descriptions.parquet'))
 
     return df
 
+@tracing.traced
 def mapAbiCodes(df, folderData):
 
     # Load the taxonomies
-    with open(path.join(folderData, 'causaliABI.json')) as jsonFile:
-        causaliAbi = load(jsonFile)
+    causaliAbi = taxonomy.loadTaxonomies(folderData)['causaliABI']
     try:
         df['CAUSALE ABI'] = df['CAUSALE ABI'].map(lambda code: causaliAbi[str(code)] if not pd.isna(code) else "")
     except KeyError as e:
@@ -181,81 +231,132 @@ def mapAbiCodes(df, folderData):
     return df
 
 
-def mapExpensives(taxonomy, desc):
-    for expensiveName, expensiveCategory in taxonomy.items():
-        if expensiveName.lower() in desc.lower():
-            if 'paypal' in desc.lower() and ('IMP. E 5,99' in desc):
-                return "Education & Culture"
-            elif 'paypal' in desc.lower() and ('IMP. E 3,10' in desc or 'IMP. E 6,20' in desc):
-                return 'Transportation'
-            else:
-                return expensiveCategory
-    return 'Other'
-
-def addExpensiveCategories(df, folderData):
-
-    # Load expensive taxonomy
-    with open(path.join(folderData, 'expensiveCategories.json')) as jsonFile:
-        expensiveCategories = load(jsonFile)
-    expensiveMapping = {expensive: cat for cat, expList in expensiveCategories.items() for expensive in expList}
+def matchFirstKeyword(lowered, pattern, ranks):
+
+    # Rank of the first keyword (in list order) found in each description
+    matches = lowered.str.findall(pattern).explode()
+    return matches.map(ranks).groupby(level = 0).min().dropna().astype('int')
+
+def mapExpensives(expensiveMatcher, descriptions):
+    pattern, ranks, categories = expensiveMatcher
+    categorized = pd.Series('Other', index = descriptions.index, dtype = 'object')
+    if len(descriptions) == 0 or len(categories) == 0:
+        return categorized
+
+    # Best ranked keyword found in each description
+    lowered = descriptions.str.lower()
+    bestRank = matchFirstKeyword(lowered, pattern, ranks)
+    categorized.loc[bestRank.index] = pd.Series(categories, dtype = 'object').iloc[bestRank.to_numpy()].to_numpy()
+
+    # Special cases (PayPal payments)
+    isPaypal = descriptions.index.isin(bestRank.index) & lowered.str.contains('paypal', regex = False)
+    categorized[isPaypal & descriptions.str.contains('IMP. E 5,99', regex = False)] = "Education & Culture"
+    categorized[isPaypal & (descriptions.str.contains('IMP. E 3,10', regex = False) | 
+                            descriptions.str.contains('IMP. E 6,20', regex = False))] = 'Transportation'
+    return categorized
+
+def deriveDescriptions(descriptions, folderData, memoFile = None, readOnly = False):
+
+    # Work on the unique descriptions only (a missing description is handled as an empty one, so that no code is -1)
+    codes, uniques = pd.factorize(descriptions, use_na_sentinel = False)
+    uniqueCodes, uniques = pd.factorize(pd.Series(np.asarray(uniques, dtype = 'object')).fillna(''))
+    codes = uniqueCodes[codes]
+    derived = pd.DataFrame({'DESCRIZIONE OPERAZIONE': np.asarray(uniques, dtype = 'object')})
+
+    # Reuse the fields derived in the previous runs (with the same taxonomies, the memo is not updated when read-only)
+    taxonomies = taxonomy.loadTaxonomies(folderData)
+    version = taxonomies['version']
+    memo = store.readMemo(memoFile, version) if memoFile else None
+    if memo is not None:
+        derived = derived.merge(memo.astype({'ID': 'Int64'}), on = 'DESCRIZIONE OPERAZIONE', how = 'left')
+    else:
+        derived[['ID', 'DESC', 'CATEGORIA']] = None
+
+    missing = derived['ID'].isna()
+    if missing.any():
+        newDescriptions = derived.loc[missing, 'DESCRIZIONE OPERAZIONE']
+
+        # Generate the ID (M5 Hash, 64 bits) 
+        derived.loc[missing, 'ID'] = store.transactionIDs(newDescriptions)
+
+        # Clean description
+        descriptionRules, incomeDescriptionRules = taxonomies['descriptionRules']
+        derived.loc[missing, 'DESC'] = cleanDescriptions(cleanDescriptions(newDescriptions, descriptionRules), incomeDescriptionRules)
+
+        # Expensive category (used only for the outgoing transactions)
+        derived.loc[missing, 'CATEGORIA'] = mapExpensives(taxonomies['expensives'], newDescriptions)
+
+        if memoFile and not readOnly:
+            memo = pd.concat([memo, derived[missing]]).astype({'ID': 'int64'})
+            store.writeMemo(memoFile, memo, version)
+    return codes, derived
+
+@tracing.traced
+def describeTransactions(df, folderData, memoFile = None, reportUnknown = False, readOnly = False):
+    
+    # Broadcast the fields derived from the unique descriptions
+    codes, derived = deriveDescriptions(df['DESCRIZIONE OPERAZIONE'], folderData, memoFile, readOnly)
+    df['ID'] = derived['ID'].to_numpy(dtype = 'int64')[codes]
+    df['DESC'] = broadcastCategorical(derived['DESC'], codes)
 
     # Map the expensive
-    expensiveFilter_cond = df['IMPORTO'] < 0
-    df.loc[expensiveFilter_cond, 'CATEGORIA'] = df.loc[expensiveFilter_cond,'DESCRIZIONE OPERAZIONE'].map(
-        lambda desc: mapExpensives(expensiveMapping, desc))
+    expensiveFilter_cond = (df['IMPORTO'] < 0).to_numpy()
+    categories = df['CATEGORIA'].to_numpy(dtype = 'object') if 'CATEGORIA' in df.columns else np.full(len(df), np.nan, dtype = 'object')
+    categories[expensiveFilter_cond] = derived['CATEGORIA'].to_numpy()[codes[expensiveFilter_cond]]
         
-    # Load one-off transaction
-    with open(path.join(folderData, 'oneOffTransactions.json')) as jsonFile:
-        oneOffTransactions = load(jsonFile)
-
     # Map the one-off expensive
-    for category, transactions in oneOffTransactions.items():
-        for transaction_id in transactions:
-            df.loc[df['ID'] == transaction_id, "CATEGORIA"] = category
-    return df
-
-def cleanDescription(desc):
-    if 'vostra disposizione a favore' in desc.lower():
-        start = desc.lower().find('a fav: ')
-        end = desc.lower().find('id.msg')
-        return desc[start: end if end > start else len(desc)].split('-')[0].strip(' -.')
-    elif 'pagamento tramite pos' in desc.lower():
-
-        start_pos1 = desc.lower().find('presso:') 
-        start_pos2 = desc.lower().find('.00 ')
-        start_pos3 = desc.lower().find(':')
-
-        if start_pos1 > 0:
-            start_pos = start_pos1 + 7
-        elif start_pos2 > 0:
-            start_pos = start_pos2 + 4
-        elif start_pos3 > 0:
-            start_pos = start_pos3 + 12
-        else:
-            start_pos = 0       
-        return desc[start_pos:].strip(' -.')
-    
-    elif "pagamenti diversi cred. " in desc.lower():
-        minimal = desc[desc.lower().find('cred. ') + 6: desc.lower().find('id.mandato')].strip(' -.')
-        minimal = 'PayPal' if 'paypal' in minimal.lower() else minimal
-        return minimal
-    
-    elif "imposte e tasse polizza" in desc.lower():
-        return desc[desc.lower().find('periodo bollo'): ].strip(' -.')
-    return desc
-
-def cleanIncomeDescription(desc):
-    if 'ordinante' and 'causale' in desc.lower():
-        return desc[desc.lower().find('ordinante: ') + 11: desc.lower().find('causale')].strip(' -.')
-    elif 'emolumenti' in desc.lower():
-        return desc[desc.lower().find('per emolumenti') + 15: desc.lower().find('accredito competenze')].strip(' -.')
-    elif 'cedole' in desc.lower():
-        #if 'btp' in desc.lower():
-        #    return desc[desc.lower().find('btp'): desc.lower().find('quantit')].strip(' -.')
-        return desc[desc.lower().find('cedole ') + 7: desc.lower().find('quantit')].strip(' -.')
-    return desc
+    overrides = taxonomy.loadTaxonomies(folderData)['overrides']
+    overriddenCategories = df['ID'].map(overrides)
+    isOverridden = overriddenCategories.notna().to_numpy()
+    categories[isOverridden] = overriddenCategories.to_numpy()[isOverridden]
+    df['CATEGORIA'] = categories
+
+    # Index the final categories of the expense descriptions (used to suggest the categories of the "Other" expenses)
+    if memoFile and not readOnly:
+        expenses = derived.iloc[np.unique(codes[expensiveFilter_cond])][['ID', 'DESC', 'CATEGORIA']]
+        expenses['CATEGORIA'] = expenses['ID'].map(overrides).fillna(expenses['CATEGORIA'])
+        suggestions.updateIndex(path.join(path.dirname(memoFile), suggestions.INDEX_FILE), expenses,
+                                suggestions.indexVersion(taxonomy.loadTaxonomies(folderData)['version'], overrides))
+
+    if reportUnknown:
+        unknownIDs = pd.Index(list(overrides.keys()), dtype = 'int64').difference(df['ID'].unique())
+        if len(unknownIDs) > 0:
+            print(f"[WARNING] {len(unknownIDs)} one-off transactions do not match any transaction:", ', '.join(sorted(store.formatIDs(unknownIDs))), "\n")
+    return store.compactTransactions(df)
+
+def broadcastCategorical(values, codes):
+
+    # Categorical column from the values of the unique descriptions (factorized once, a missing value keeps the code -1)
+    if len(codes) > 0 and codes.min() < 0:
+        raise ValueError("Invalid description codes: every transaction must map to a description")
+    valueCodes, categories = pd.factorize(values)
+    return pd.Categorical.from_codes(valueCodes[codes], categories)
+
+def cleanDescriptions(descriptions, descriptionRules):
+    triggerPattern, triggerRanks, patterns, aliases = descriptionRules
+    cleaned = descriptions.copy()
+    if len(descriptions) == 0 or len(patterns) == 0:
+        return cleaned
+
+    # Select the first triggered rule of each description
+    firedRules = matchFirstKeyword(descriptions.str.lower(), triggerPattern, triggerRanks)
+
+    for rule, ruleDescriptions in descriptions[firedRules.index].groupby(firedRules):
+
+        # Extract the description with the first matching pattern
+        extracted = pd.Series(None, index = ruleDescriptions.index, dtype = 'object')
+        for pattern in patterns[rule]:
+            missing = extracted.isna()
+            if not missing.any():
+                break
+            extracted[missing] = ruleDescriptions[missing].str.extract(pattern, expand = False)
+        extracted = extracted.dropna().str.strip(' -.')
+        
+        # Replace with the aliases
+        for keyword, alias in aliases[rule].items():
+            extracted[extracted.str.lower().str.contains(keyword, regex = False)] = alias
+        cleaned[extracted.index] = extracted
+    return cleaned
 
 def loadBudget(folderData = path.join('taxonomies')): #path.join(path.dirname(__file__), '..', 'taxonomies')
-    budget = pd.read_excel(path.join(folderData, 'budget.xlsx'), sheet_name='Budget', index_col = 0, usecols = [0,1])
-    budget = budget['BUDGET'].astype('int').to_dict()
-    return budget    
\ No newline at end of file
+    return taxonomy.loadTaxonomies(folderData)['budget']    
\ No newline at end of file
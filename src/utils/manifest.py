@@ -0,0 +1,37 @@
+from os import path
+from json import load, dump, dumps
+from hashlib import md5
+import pandas as pd
+
+def fileFingerprint(filePath):
+    if not path.exists(filePath):
+        return None
+    with open(filePath, 'rb') as file:
+        return md5(file.read()).hexdigest()
+
+def frameFingerprint(df):
+
+    # Content of the rows (index excluded), column names and attributes
+    content = md5(pd.util.hash_pandas_object(df, index = False).to_numpy().tobytes())
+    content.update(dumps([list(map(str, df.columns)), df.attrs], sort_keys = True, default = str).encode())
+    return content.hexdigest()
+
+def fingerprint(*parts):
+    return md5(dumps(parts, default = str).encode()).hexdigest()
+
+def readManifest(manifestFile):
+    if not path.exists(manifestFile):
+        return dict()
+    with open(manifestFile, 'r') as file:
+        return load(file)
+
+def isUpToDate(manifest, name, inputsFingerprint, outputs):
+
+    # Same inputs of the last build and the outputs are still there
+    return manifest.get(name) == inputsFingerprint and all(path.exists(output) for output in outputs)
+
+def updateManifest(manifestFile, fingerprints):
+    manifest = readManifest(manifestFile)
+    manifest.update(fingerprints)
+    with open(manifestFile, 'w') as file:
+        dump(manifest, file, indent = 4, sort_keys = True)
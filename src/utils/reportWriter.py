@@ -0,0 +1,100 @@
+import pandas as pd
+import xlsxwriter
+from xlsxwriter.exceptions import FileCreateError
+from xlsxwriter.utility import xl_cell_to_rowcol
+
+class ReportWriter:
+
+    def __init__(self, filePath, defaultFormat = None, dateFormat = None):
+
+        # Rows are streamed to disk (they must be written top to bottom)
+        options = {'constant_memory': True}
+        if dateFormat:
+            options['default_date_format'] = dateFormat
+        self.book = xlsxwriter.Workbook(filePath, options)
+        self.styles = dict()
+
+        # Format of the cells without a specific format
+        for prop, value in (defaultFormat or dict()).items():
+            getattr(self.book.formats[0], 'set_' + prop)(value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.book.close()
+        except FileCreateError:
+            raise PermissionError("Close the spreadsheet...")
+
+    def style(self, properties):
+
+        # Create each format once
+        if properties is None:
+            return None
+        key = tuple(sorted(properties.items()))
+        if key not in self.styles:
+            self.styles[key] = self.book.add_format(properties)
+        return self.styles[key]
+
+    def writeFrame(self, sheetName, df, index = True, header = None, columns = dict(), freeze_panes = None, links = dict(), max_width = 80):
+        sheet = self.book.add_worksheet(sheetName)
+        if isinstance(df, pd.Series):
+            df = df.to_frame()
+
+        # Cell values (the index first)
+        nlevels = df.index.nlevels if index else 0
+        table = df.reset_index(drop = not index)
+        names = ([name if name is not None else '' for name in df.index.names] if index else []) + list(df.columns)
+        values = [_cellValues(table.iloc[:, col], isIndex = nlevels == 1 and col == 0) for col in range(len(names))]
+        if nlevels > 1:
+            values[:nlevels] = _sparsify(values[:nlevels])
+
+        # Column settings: automatic width, then the custom width/format/options
+        settings = {col: {'width': _width(name, colValues, max_width)} for col, (name, colValues) in enumerate(zip(names, values))}
+        for colRange, setting in columns.items():
+            first, last = [xl_cell_to_rowcol(col + '1')[1] for col in colRange.split(':')]
+            for col in range(first, last + 1):
+                settings.setdefault(col, {'width': None}).update(setting)
+        for col, setting in settings.items():
+            options = {option: value for option, value in setting.items() if option not in ['width', 'format']}
+            sheet.set_column(col, col, setting.get('width'), self.style(setting.get('format')), options)
+
+        if freeze_panes:
+            sheet.freeze_panes(*freeze_panes)
+
+        # Header
+        header_format = self.style(header)
+        for col, name in enumerate(names):
+            sheet.write(0, col, str(name), header_format)
+
+        # Rows (in order)
+        linkedCols = {names.index(name): urls for name, urls in links.items()}
+        link_format = self.style({'font_size': self.book.formats[0].font_size, 'font_color': 'black'})
+        for row, rowValues in enumerate(zip(*values), start = 1):
+            sheet.write_row(row, 0, rowValues)
+            for col, urls in linkedCols.items():
+                sheet.write_url(row, col, urls[row - 1], link_format, string = str(rowValues[col]))
+        return sheet
+
+def _cellValues(series, isIndex = False):
+
+    # Single period index --> dates, period values --> text
+    if isinstance(series.dtype, pd.PeriodDtype):
+        series = series.dt.to_timestamp() if isIndex else series.astype('str')
+    return series.astype('object').where(series.notna(), None).tolist()
+
+def _sparsify(levels):
+
+    # Show the outer index levels only when they change
+    sparse = [list(level) for level in levels]
+    for row in range(len(levels[0]) - 1, 0, -1):
+        for lnum in range(len(levels) - 1):
+            if levels[lnum][row] != levels[lnum][row - 1]:
+                break
+            sparse[lnum][row] = None
+    return sparse
+
+def _width(name, values, max_width):
+    lengths = [len(line) for value in values if value is not None for line in str(value).split('\n')]
+    return min(max(lengths + [len(str(name))]) + 2, max_width)
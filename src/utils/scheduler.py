@@ -0,0 +1,107 @@
+from os import path, makedirs
+from time import perf_counter
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# LOCAL IMPORTS
+from utils import store, manifest
+
+class Shared:
+
+    # Placeholder of a dataframe shared with the workers
+    def __init__(self, name):
+        self.name = name
+
+class Scheduler:
+
+    def __init__(self, sharedFolder, workers = None, manifestFile = None, pool = None):
+        self.sharedFolder = sharedFolder
+        self.workers = workers
+        self.pool = pool
+        self.manifestFile = manifestFile
+        self.shared = dict()
+        self.fingerprints = dict()
+        self.stages = dict()
+
+    def share(self, name, df):
+
+        # Save the dataframe once, the workers memory-map it instead of unpickling a copy
+        makedirs(self.sharedFolder, exist_ok = True)
+        self.shared[name] = path.join(self.sharedFolder, name + '.arrow')
+        store.writeArrow(self.shared[name], df)
+        self.fingerprints[name] = manifest.frameFingerprint(df)
+
+    def add(self, name, target, args = (), after = [], inputs = [], outputs = []):
+        for dependency in after:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on the unknown stage '{dependency}'")
+        for arg in args:
+            if isinstance(arg, Shared) and arg.name not in self.shared:
+                raise ValueError(f"Stage '{name}' uses the unshared dataframe '{arg.name}'")
+        self.stages[name] = {'target': target, 'args': tuple(args), 'after': set(after), 'inputs': inputs, 'outputs': outputs}
+
+    def fingerprint(self, stage, built):
+
+        # Function, arguments (the content of the shared dataframes), input files and the inputs of the previous stages
+        args = [self.fingerprints[arg.name] if isinstance(arg, Shared) else arg for arg in stage['args']]
+        inputs = [manifest.fileFingerprint(inputFile) for inputFile in stage['inputs']]
+        return manifest.fingerprint(stage['target'].__module__, stage['target'].__qualname__, args, inputs, 
+                                    sorted(built[dependency] for dependency in stage['after']))
+
+    def run(self):
+        timings, errors, built = dict(), dict(), dict()
+        pending = dict(self.stages)
+        running = dict()
+        lastBuild = manifest.readManifest(self.manifestFile) if self.manifestFile else dict()
+
+        # Reuse the pool of the caller (e.g. warm workers of the watch mode)
+        with nullcontext(self.pool) if self.pool else ProcessPoolExecutor(max_workers = self.workers) as pool:
+            while pending or running:
+
+                # Submit the stages whose dependencies are completed
+                for name, stage in list(pending.items()):
+                    if stage['after'] & errors.keys():
+                        errors[name] = RuntimeError(f"Skipped: a dependency of '{name}' has failed")
+                        del pending[name]
+                    elif stage['after'] <= timings.keys():
+                        del pending[name]
+
+                        # Skip the stages whose inputs have not changed since the last build
+                        built[name] = self.fingerprint(stage, built)
+                        if self.manifestFile and manifest.isUpToDate(lastBuild, name, built[name], stage['outputs']):
+                            timings[name] = 0.0
+                            print(f"[SKIP] {name}: up to date")
+                        else:
+                            running[pool.submit(_runStage, stage['target'], stage['args'], self.shared)] = name
+
+                if not running:
+                    break
+
+                # Wait for the next stage
+                done, _ = wait(running.keys(), return_when = FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        timings[name] = future.result()
+                        print(f"[TIME] {name}: {timings[name]:.2f} s")
+                    except Exception as error:
+                        errors[name] = error
+                        print(f"[ERROR] {name}: {error!r}")
+
+        # Record the stages built successfully
+        if self.manifestFile:
+            manifest.updateManifest(self.manifestFile, {name: built[name] for name in timings})
+
+        # Propagate the first error to the caller
+        if errors:
+            error = next(iter(errors.values()))
+            raise RuntimeError(f"{len(errors)} stage(s) failed: {', '.join(errors.keys())}") from error
+        return timings
+
+def _runStage(target, args, shared):
+    start = perf_counter()
+
+    # Map the shared dataframes
+    args = [store.mapArrow(shared[arg.name]) if isinstance(arg, Shared) else arg for arg in args]
+    target(*args)
+    return perf_counter() - start
@@ -1,260 +1,288 @@
 from configparser import ConfigParser
 from os import path
-from collections import Counter
+from hashlib import md5
 import pandas as pd
 import numpy as np
 
 # LOCAL IMPORTS
-from utils import graphs
+from utils import store, manifest, tracing, budgets
 from utils.dataLoader import loadBudget
 
-def group_expensive(df, outputFolder, feature = "CAUSALE ABI", include_incomes = False): 
+# Dimensions of the aggregated transactions (SEGNO: -1 outgoing, 1 incoming), the amounts are summed in cents
+CUBE_DIMENSIONS = ['MESE', 'TRIMESTRE', 'ANNO', 'MACRO-CATEGORIA', 'CATEGORIA', 'CAUSALE ABI', 'DESC', 'SEGNO']
+
+@tracing.traced
+def build_cube(df):
+
+    # Create the macro-category
+    df = df.assign(**{'SEGNO': np.sign(df['IMPORTO']).astype('int8'), '#': 1})
+    df['MACRO-CATEGORIA'] = np.where(df['IMPORTO'] > 0, 'ENTRATE', 'USCITE')
+    df.loc[df['CATEGORIA'] == 'Investments', 'MACRO-CATEGORIA'] = 'INVESTIMENTI'
+
+    # Sum and count the transactions of each combination
+    cube = df.groupby(by = CUBE_DIMENSIONS, dropna = False, observed = True)[['IMPORTO', '#']].sum().reset_index()
+
+    # Keep the period covered by the transactions
+    cube.attrs = {'first_date': str(df['DATA'].min().date()), 
+                  'first_transaction': str(df['VALUTA'].min().date()), 'last_transaction': str(df['VALUTA'].max().date())}
+    return cube
+
+def period_offsets(frame, key = 'MESE'):
+    if len(frame) == 0:
+        return dict()
+
+    # First and last (excluded) row of each period (the cube is sorted by month)
+    ordinals = frame[key].array.asi8
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(ordinals)) + 1])
+    stops = np.append(starts[1:], len(ordinals))
+    return {period: (start, stop) for period, start, stop in zip(frame[key].iloc[starts], starts, stops)}
+
+def period_slice(frame, first = None, last = None, key = 'MESE'):
+
+    # Rows between two dates, months, quarters or years with a binary search (the cube is sorted by month)
+    ordinals, freq = frame[key].array.asi8, frame[key].dt.freq
+    start = np.searchsorted(ordinals, pd.Period(first).asfreq(freq, 'start').ordinal, 'left') if first is not None else 0
+    stop = np.searchsorted(ordinals, pd.Period(last).asfreq(freq, 'end').ordinal, 'right') if last is not None else len(ordinals)
+    return frame.iloc[start:stop]
+
+def merge_cubes(cube, new_cube):
+
+    # Add the aggregates of the new transactions to the cube
+    merged = store.concatTransactions([cube, new_cube]).groupby(by = CUBE_DIMENSIONS, dropna = False, observed = True)[['IMPORTO', '#']].sum().reset_index()
+    merged.attrs = {'first_date': min(cube.attrs['first_date'], new_cube.attrs['first_date']),
+                    'first_transaction': min(cube.attrs['first_transaction'], new_cube.attrs['first_transaction']),
+                    'last_transaction': max(cube.attrs['last_transaction'], new_cube.attrs['last_transaction'])}
+    return merged
+
+def group_ranks(keys, order):
+
+    # Position of each key in the given order (sort key of the groups)
+    return pd.Series(np.arange(len(order)), index = order).reindex(keys).to_numpy()
+
+def summarize_operations(df, keys, sign = 1, sort_by = ['TOTAL', '#'], sep = ' | '):
+
+    # Count and total of each description within each group
+    summary = df[keys + ['DESC', 'IMPORTO', '#']].groupby(by = keys + ['DESC'], observed = True).sum()
+    summary = summary.rename(columns = {'IMPORTO': 'TOTAL'}).reset_index()
+    summary['TOTAL'] = summary['TOTAL'] * sign / 100
+
+    # Rank the descriptions within each group
+    summary = summary.sort_values(by = keys + sort_by, ascending = [True] * len(keys) + [False] * len(sort_by), kind = 'stable')
+
+    # Format the descriptions, e.g. "COOP (x3, 45 €)"
+    amounts = summary['TOTAL'].astype('str').where(summary['TOTAL'] < 1, np.trunc(summary['TOTAL']).astype('int64').astype('str'))
+    counts = (" (x" + summary['#'].astype('str') + ", ").where(summary['#'] > 1, ' (')
+    summary['OPERAZIONI'] = summary['DESC'].astype('str') + counts + amounts + " €)"
     
-    df = df.copy()
-    df['DESC'] += "!"
-    df['#'] = 1
+    return summary.groupby(by = keys, observed = True, sort = False)['OPERAZIONI'].agg(sep.join)
+
+@tracing.traced(label = ('feature', ))
+def group_expensive(cube, outputFolder, feature = "CAUSALE ABI", include_incomes = False, piecesFile = None): 
+    from utils.reportWriter import ReportWriter # xlsxwriter is imported only to write the workbooks
+    from xlsxwriter.utility import xl_col_to_name
     
     # Data filtering
-    if not include_incomes:
-        df = df[df['IMPORTO'] < 0]
-
-    # (1.a) Add expensives by description
-    groupedByDesc = df[['DESC', 'IMPORTO', 'MESE']].groupby(by = ['DESC', 'MESE']).sum()
-
-    # (1) Group expensives by month
-    expensivesByMonth = df[['MESE', 'IMPORTO', 'DESC', '#', feature]].groupby(by = ['MESE', feature], as_index = True).sum()    # 
-    expensivesByMonth['OPERAZIONI'] = expensivesByMonth['DESC'].str.split('!').map(
-        lambda items: [item for item in items if item != ""] if isinstance(items, list) else items)
-    expensivesByMonth['OPERAZIONI'] = expensivesByMonth['OPERAZIONI'].map(Counter).map(Counter.items)
-    expensivesByMonth['OPERAZIONI'] = expensivesByMonth.apply(
-        lambda df_row: [expensive + tuple([groupedByDesc.loc[(expensive[0] + "!", df_row.name[0]), 'IMPORTO'].round(2) * -1])
-                        for expensive in df_row['OPERAZIONI']], axis = 1)
-    expensivesByMonth['OPERAZIONI'] = expensivesByMonth['OPERAZIONI'].map(lambda items: sorted(items, key = lambda item: (item[2], item[1]), reverse = True))
-    expensivesByMonth['OPERAZIONI'] = expensivesByMonth['OPERAZIONI'].map(
-        lambda items: ' | '.join([item[0] + (f" (x{item[1]}, " if item[1] > 1 else ' (') + str(int(item[2]) if item[2] >= 1 else item[2]) + " €)"
-                                   for item in items]))
-    
-    expensivesByMonth = expensivesByMonth.drop(columns = ['DESC']).sort_index(ascending = False)
+    df = cube.copy() if include_incomes else cube[cube['SEGNO'] < 0].copy()
+    budget = loadBudget() if feature == 'CATEGORIA' else None
+
+    # (1) Monthly sheets: recompute only the months whose transactions have changed (the others are cached)
+    version = manifest.fingerprint(feature, include_incomes, budget.to_dict('records') if budget is not None else None)
+    pieces = store.readPieces(piecesFile, version) if piecesFile else dict()
+    offsets = period_offsets(df, key = 'MESE')
+    fingerprints = partition_fingerprints(df[['MESE', 'IMPORTO', '#', 'DESC', feature]], offsets)
+    changed = [month for month, fingerprint in fingerprints.items() if pieces.get(month, (None, ))[0] != fingerprint]
+    for month in changed:
+        pieces[month] = (fingerprints[month], ) + month_expensives(df.iloc[slice(*offsets[month])], month, feature, budget)
+
+    pieces = {month: pieces[month] for month in sorted(fingerprints.keys(), reverse = True)}
+    if piecesFile and len(changed) > 0:
+        store.writePieces(piecesFile, pieces, version)
+    monthly_dfs = {month: partial_df for month, (_, partial_df, _) in pieces.items()}
+    warnings = [monthlyWarnings for _, _, monthlyWarnings in pieces.values() if monthlyWarnings is not None]
 
     # (2) Group expensives by code
     df['TRIMESTRE'] = df['TRIMESTRE'].dt.strftime('Q%q')
-    groupedByCategory = df[['TRIMESTRE', 'ANNO',  'IMPORTO', feature]].groupby(by = [feature, 'ANNO', 'TRIMESTRE']).sum() 
+    groupedByCategory = df[['TRIMESTRE', 'ANNO',  'IMPORTO', feature]].groupby(by = [feature, 'ANNO', 'TRIMESTRE'], observed = True).sum() 
 
     # (2.a) Sort index by code importance
-    topAbiCodesByExpensive = df[['IMPORTO', feature]].groupby(by = [feature]).sum().sort_values(by ='IMPORTO', ascending = True).index.to_list()
-    groupedByCategory['RANK'] = [topAbiCodesByExpensive.index(entry[0]) for entry in groupedByCategory.index] 
+    topAbiCodesByExpensive = df[['IMPORTO', feature]].groupby(by = [feature], observed = True).sum().sort_values(by ='IMPORTO', ascending = True).index
+    groupedByCategory['RANK'] = group_ranks(groupedByCategory.index.get_level_values(feature), topAbiCodesByExpensive)
 
     groupedByCategory = groupedByCategory.sort_values(by = ['RANK', 'ANNO', 'TRIMESTRE',  'IMPORTO'], ascending = [True, False, False, False]).drop(columns = 'RANK')
 
     # (2.b) Round the imports
-    groupedByCategory['IMPORTO'] = groupedByCategory['IMPORTO'].round(0)
+    groupedByCategory['IMPORTO'] = (groupedByCategory['IMPORTO'] / 100).round(0)
 
-    # (2.c) Add budget
+    # (2.c) Add budget (sum of the monthly budgets of the quarter)
     if feature == 'CATEGORIA':
-        budget = loadBudget()
-
-        try:
-            groupedByCategory['Δ BUDGET'] = groupedByCategory.apply(
-                lambda df_row: round(- df_row['IMPORTO'] - (budget[df_row.name[0]] * 3), 0) , axis = 1)
-            
-            groupedByCategory['Δ BUDGET (%)'] = groupedByCategory.apply(
-                lambda df_row: df_row['Δ BUDGET'] / (budget[df_row.name[0]] * 3) if budget[df_row.name[0]] > 0 else 9.99, axis = 1)
+        index = groupedByCategory.index
+        quarters = pd.PeriodIndex(index.get_level_values('ANNO').astype('str') + index.get_level_values('TRIMESTRE'), freq = 'Q')
+        quarterBudgets = budgets.periodBudgets(budget, index.get_level_values(feature), quarters)
+        groupedByCategory['Δ BUDGET'], groupedByCategory['Δ BUDGET (%)'] = budgets.variance(groupedByCategory['IMPORTO'], quarterBudgets)
+
+    # Rank the warnings
+    if len(warnings) > 0:
+        warnings = pd.pivot_table(pd.concat(warnings), index=['CATEGORIA', 'MESE'])
         
-        except KeyError as missingBudgetCategory:
-            raise Exception(f'\n{missingBudgetCategory} is not in the budget! Please include it in the budget file.\n')
-
-    # Monthly stats
-    warnings = []
-    monthly_dfs = dict()
-    for month in expensivesByMonth.index.get_level_values(0).unique():
-        partial_df = expensivesByMonth.loc[month, :].sort_values(by = 'IMPORTO', ascending = True) 
-
-        # Add new columns 
-        partial_df.insert(loc = 1, column = '%', value = (partial_df['IMPORTO'] / partial_df['IMPORTO'].sum()).round(2))
-
-        # Delta from budget
-        if feature == 'CATEGORIA':
-            partial_df.insert(loc = 2, column = 'Δ BUDGET', value = partial_df.apply(
-                lambda df_row: round(-df_row['IMPORTO'] - budget[df_row.name], 0), axis = 1))
-            partial_df.insert(loc = 3, column = 'Δ BUDGET (%)', value = partial_df.apply(
-                lambda df_row: df_row['Δ BUDGET'] / budget[df_row.name] if budget[df_row.name] > 0 else 9.99, axis = 1))
-
-            partial_df.loc[''] = None
-            partial_df.loc['_TOTAL'] = {'IMPORTO': partial_df['IMPORTO'].sum(), 'Δ BUDGET' : partial_df['Δ BUDGET'].sum(),
-                                        'Δ BUDGET (%)': partial_df['Δ BUDGET'].sum() / np.sum(list(budget.values()))}
-            
-            partial_df.insert(loc = 3, column = "!", value = partial_df['Δ BUDGET (%)'].map(lambda x: 1 if x >= 0.5 else 0 if x >=0 else -1))
-            partial_df.loc[['_TOTAL', ''], '!'] = None
-
-            monthlyWarnings = partial_df.loc[partial_df['!'] == 1, ['Δ BUDGET (%)']]
-            monthlyWarnings.insert(loc = 0, column = 'MESE', value = month)
-
-            if 'Investments' in monthlyWarnings.index:
-                monthlyWarnings = monthlyWarnings.drop(index = 'Investments')
-            monthlyWarnings = monthlyWarnings.reset_index()
-            
-            warnings.append(monthlyWarnings)
-        monthly_dfs[month] = partial_df
+        ranks = warnings[['Δ BUDGET (%)']].groupby('CATEGORIA').sum().sort_values(by = 'Δ BUDGET (%)', ascending=False).index
+        warnings['ranks'] = group_ranks(warnings.index.get_level_values('CATEGORIA'), ranks)
+        warnings = warnings.sort_values(by = ['ranks', 'Δ BUDGET (%)', 'MESE'], ascending = [True, False, False]).drop(columns = 'ranks')
+
+    # Graphical settings
+    euro_fmt = {'num_format': '#,##0 €', 'font_size': 16}
+    perc_fmt = {"num_format": "0%", 'font_size': 16}
+    index_fmt = {'bold': True, 'font_size': 16, 'align': 'vcenter'}
+    header_format = {'bg_color': '#3D3B40', 'font_color': 'white', 'bold': False, 'valign': 'center', 'font_size': 20}
+    sheetNames = {month: month.strftime('%B %Y') for month in monthly_dfs.keys()}
 
     # Save the excel file
     fileName = 'expensives' + ('byAbiCode' if feature == "CAUSALE ABI" else '') + '.xlsx'
-    try:    
-        with pd.ExcelWriter(path.join(outputFolder, fileName), engine = 'xlsxwriter') as excelFile:
-            groupedByCategory.to_excel(excelFile, sheet_name = 'Overview', freeze_panes = (1,1))
-
-            euro_fmt = excelFile.book.add_format({'num_format': '#,##0 €', 'font_size': 16})
-            perc_fmt = excelFile.book.add_format({"num_format": "0%", 'font_size': 16})
-            index_fmt = excelFile.book.add_format({"align": "left", 'bold': True, 'font_size': 16, 'align': 'vcenter'})
-            header_format = excelFile.book.add_format({'bg_color': '#3D3B40', 'font_color': 'white', 'bold': False, 'valign': 'center', 'font_size': 20})
-            excelFile.book.formats[0].set_font_size(16)
-            excelFile.book.formats[0].set_align('vcenter')
-            excelFile.book.formats[0].set_align('center')
-            excelFile.sheets['Overview'].set_row(0, None, header_format)
-            excelFile.sheets['Overview'].set_column('D:E', cell_format = euro_fmt)
-            excelFile.sheets['Overview'].set_column('F:F', cell_format = perc_fmt) #  width = 12, 
-            excelFile.sheets['Overview'].set_column('A:A', cell_format = index_fmt)
-            #excelFile.sheets['Overview'].set_column('A:A', width = 20)
-            excelFile.sheets['Overview'].conditional_format('E1:E999', {
-                'type': '3_color_scale', 'min_color': "#99BC85",'mid_color': "white", 'mid_type': 'num',  'mid_value': 0, 'max_color': "#C83E3E"})
-            excelFile.sheets['Overview'].conditional_format('F1:F999', {
+    with ReportWriter(path.join(outputFolder, fileName), defaultFormat = {'font_size': 16, 'align': 'center', 'valign': 'vcenter'}) as report:
+        sheet = report.writeFrame('Overview', groupedByCategory, header = header_format, freeze_panes = (1, 1),
+                                  columns = {'A:A': {'format': index_fmt}, 'D:E': {'format': euro_fmt}, 'F:F': {'format': perc_fmt}})
+        sheet.conditional_format('E1:E999', {
             'type': '3_color_scale', 'min_color': "#99BC85",'mid_color': "white", 'mid_type': 'num',  'mid_value': 0, 'max_color': "#C83E3E"})
-            excelFile.sheets['Overview'].conditional_format('D1:D999', {
-                        'type': '2_color_scale', 'min_color': '#C83E3E', 'max_color': '#E6A8A8'})
-            excelFile.sheets['Overview'].autofit()
+        sheet.conditional_format('F1:F999', {
+            'type': '3_color_scale', 'min_color': "#99BC85",'mid_color': "white", 'mid_type': 'num',  'mid_value': 0, 'max_color': "#C83E3E"})
+        sheet.conditional_format('D1:D999', {
+            'type': '2_color_scale', 'min_color': '#C83E3E', 'max_color': '#E6A8A8'})
+
+        if len(warnings) > 0:
+
+            # Link each month to its sheet
+            links = [f"internal:'{sheetNames[month]}'!A1" for month in warnings.index.get_level_values('MESE')]
+            sheet = report.writeFrame('Warnings', warnings, header = header_format, freeze_panes = (1, 1), links = {'MESE': links},
+                                      columns = {'A:A': {'format': index_fmt}, 'C:C': {'format': perc_fmt}})
+            sheet.conditional_format(f'C2:C{len(warnings) + 1}', {
+                    'type': '2_color_scale', 'min_color': '#E6A8A8', 'max_color': '#C83E3E'})
+
+        for month, monthly_df in monthly_dfs.items():
+
+            # Graphical settings
+            columns = {'A:A': {'format': index_fmt}, 'B:B': {'format': euro_fmt}, 'C:C': {'format': perc_fmt}}
+            if feature == 'CATEGORIA':
+                columns.update({'D:D': {'width': 8, 'format': euro_fmt}, 'F:F': {'width': 12, 'format': perc_fmt}, 
+                                'E:E': {'width': 2}, 'G:G': {'width': 2}})
+            last_col = xl_col_to_name(len(monthly_df.columns))
+            columns[f'{last_col}:{last_col}'] = {'width': 60, 'format': {"align": "left", 'font_size': 16}}
+
+            # Save the sheet
+            sheet = report.writeFrame(sheetNames[month], monthly_df, header = header_format, freeze_panes = (1, 1), columns = columns)
+            sheet.conditional_format(f'B2:B{len(monthly_df) - 1}', {
+                    'type': '2_color_scale', 'min_color': '#C83E3E', 'max_color': '#E6A8A8'})
 
-            if len(warnings) > 0:
-                warnings = pd.pivot_table(pd.concat(warnings), index=['CATEGORIA', 'MESE'])
-                
-                ranks = warnings[['Δ BUDGET (%)']].groupby('CATEGORIA').sum().sort_values(by = 'Δ BUDGET (%)', ascending=False).index.to_list()
-                warnings['ranks'] = [ranks.index(cat[0]) for cat in warnings.index]
-                warnings = warnings.sort_values(by = ['ranks', 'Δ BUDGET (%)', 'MESE'], ascending = [True, False, False]).drop(columns = 'ranks')
-    
-                warnings.to_excel(excelFile, sheet_name = 'Warnings', freeze_panes = (1,1)) 
-                excelFile.sheets['Warnings'].set_column('A:A', cell_format = index_fmt)
-                excelFile.sheets['Warnings'].set_column('C:C', cell_format = perc_fmt)
-                excelFile.sheets['Warnings'].set_row(0, None, header_format)
-                excelFile.sheets['Warnings'].conditional_format(f'C2:C{len(warnings) + 1}', {
-                        'type': '2_color_scale', 'min_color': '#E6A8A8', 'max_color': '#C83E3E'})
-                excelFile.sheets['Warnings'].autofit()
-
-            for month, monthly_df in monthly_dfs.items():
-
-                # Save the sheet
-                sheetName = month.strftime('%B %Y')
-                monthly_df.to_excel(excelFile, sheet_name = sheetName, index = True,  freeze_panes = (1,1))
-
-                # Graphical settings
-                excelFile.sheets[sheetName].set_row(0, None, header_format)
-                excelFile.sheets[sheetName].set_column('A:A', cell_format = index_fmt)
-                excelFile.sheets[sheetName].set_column('B:B', cell_format = euro_fmt) #  width = 8, 
-                excelFile.sheets[sheetName].set_column('C:C', cell_format = perc_fmt) #  width = 5,
-                excelFile.sheets[sheetName].set_column(first_col = len(partial_df.columns), last_col =len(partial_df.columns), 
-                                                    width = 60, cell_format = excelFile.book.add_format({"align": "left", 'font_size': 16}))
-                
-                excelFile.sheets[sheetName].conditional_format(f'B2:B{len(monthly_df) - 1}', {
-                        'type': '2_color_scale', 'min_color': '#C83E3E', 'max_color': '#E6A8A8'})
-
-                if feature == 'CATEGORIA':
-                    excelFile.sheets[sheetName].set_column('D:D', width = 8, cell_format = euro_fmt)
-                    excelFile.sheets[sheetName].set_column('F:F', width = 12, cell_format = perc_fmt)
-                    excelFile.sheets[sheetName].set_column('E:E', width = 2)
-                    excelFile.sheets[sheetName].set_column('G:G', width = 2)
-
-                    excelFile.sheets[sheetName].conditional_format(f'C2:C{len(monthly_df) - 1}', {
-                        "type": "data_bar", "min_type": "num", "max_type": "num", "min_value": 0, "max_value": 1, 
-                        "bar_color": "#CFD8DC", "bar_solid": True, "bar_only": False, "bar_direction":'right'})
-                    excelFile.sheets[sheetName].conditional_format(f'E2:E{len(monthly_df) - 1 }', {
-                        'type': 'icon_set', 'icon_style': '3_symbols_circled', 'icons_only': True, 'reverse_icons': True,
-                        'icons': [
-                            {'criteria': '>=', 'type': 'number', 'value': 1},
-                            {'criteria': '<=', 'type': 'number', 'value': 0},
-                            {'criteria': '<',  'type': 'number', 'value': -1}]
-                        })
-                    
-                    excelFile.sheets[sheetName].conditional_format(f'D2:D{len(monthly_df) -1}', {
-                        'type': '3_color_scale', 'min_color': "#99BC85",'mid_color': "white", 'mid_type': 'num', 'mid_value': 0, 'max_color': "#C83E3E"})
-                    excelFile.sheets[sheetName].conditional_format(f'F2:F{len(monthly_df) - 1}', {
-                        'type': '3_color_scale', 'min_color': "#99BC85",'mid_color': "white", 'mid_type': 'num',  'mid_value': 0, 'max_color': "#C83E3E"})
-                excelFile.sheets[sheetName].autofit()
-            
             if feature == 'CATEGORIA':
-                mapping = dict(zip(map(str, monthly_dfs.keys()), list(excelFile.sheets.keys())[2:]))
-                for idk, item in enumerate(warnings.index.get_level_values(1).astype(str)):
-                    excelFile.sheets['Warnings'].write_url(idk + 1, 1, f"internal:'{mapping[item]}'!A1", string = item, 
-                                                        cell_format = excelFile.book.add_format({'font_size': 16, 'font_color': 'black'}))
-    except PermissionError:
-        raise PermissionError("Close the spreadsheet...")
+                sheet.conditional_format(f'C2:C{len(monthly_df) - 1}', {
+                    "type": "data_bar", "min_type": "num", "max_type": "num", "min_value": 0, "max_value": 1, 
+                    "bar_color": "#CFD8DC", "bar_solid": True, "bar_only": False, "bar_direction":'right'})
+                sheet.conditional_format(f'E2:E{len(monthly_df) - 1 }', {
+                    'type': 'icon_set', 'icon_style': '3_symbols_circled', 'icons_only': True, 'reverse_icons': True,
+                    'icons': [
+                        {'criteria': '>=', 'type': 'number', 'value': 1},
+                        {'criteria': '<=', 'type': 'number', 'value': 0},
+                        {'criteria': '<',  'type': 'number', 'value': -1}]
+                    })
+                
+                sheet.conditional_format(f'D2:D{len(monthly_df) -1}', {
+                    'type': '3_color_scale', 'min_color': "#99BC85",'mid_color': "white", 'mid_type': 'num', 'mid_value': 0, 'max_color': "#C83E3E"})
+                sheet.conditional_format(f'F2:F{len(monthly_df) - 1}', {
+                    'type': '3_color_scale', 'min_color': "#99BC85",'mid_color': "white", 'mid_type': 'num',  'mid_value': 0, 'max_color': "#C83E3E"})
     print("[DONE] Grouped expensive by:", feature, "\n")
 
 
-def expensive_graph(df, outputFolder, groupby = 'TRIMESTRE', feature = "CATEGORIA"):
-    df = df[df['IMPORTO'] < 0]
+def partition_fingerprints(df, offsets):
+
+    # Content of the rows of each partition (e.g. month)
+    hashes = pd.util.hash_pandas_object(df, index = False).to_numpy()
+    return {partition: md5(hashes[start:stop].tobytes()).hexdigest() for partition, (start, stop) in offsets.items()}
+
+def month_expensives(df, month, feature, budget = None):
+
+    # Expensives of the month by feature (with their descriptions)
+    partial_df = df[['IMPORTO', '#', feature]].groupby(by = feature, observed = True).sum().sort_index(ascending = False)
+    partial_df['IMPORTO'] = partial_df['IMPORTO'] / 100
+    partial_df['OPERAZIONI'] = summarize_operations(df, keys = [feature], sign = -1, sort_by = ['TOTAL', '#'], sep = ' | ')
+    partial_df = partial_df.sort_values(by = 'IMPORTO', ascending = True) 
+
+    # Add new columns 
+    partial_df.insert(loc = 1, column = '%', value = (partial_df['IMPORTO'] / partial_df['IMPORTO'].sum()).round(2))
+    if feature != 'CATEGORIA':
+        return partial_df, None
+
+    # Delta from the budget effective in the month
+    monthBudgets = budgets.monthlyBudgets(budget, partial_df.index, np.full(len(partial_df), month.ordinal))
+    delta, ratio = budgets.variance(partial_df['IMPORTO'], monthBudgets)
+    partial_df.insert(loc = 2, column = 'Δ BUDGET', value = delta)
+    partial_df.insert(loc = 3, column = 'Δ BUDGET (%)', value = ratio)
+
+    partial_df.loc[''] = None
+    partial_df.loc['_TOTAL'] = {'IMPORTO': partial_df['IMPORTO'].sum(), 'Δ BUDGET' : partial_df['Δ BUDGET'].sum(),
+                                'Δ BUDGET (%)': partial_df['Δ BUDGET'].sum() / budgets.rangeBudgets(budget, month, month).sum()}
+    
+    partial_df.insert(loc = 3, column = "!", value = partial_df['Δ BUDGET (%)'].map(lambda x: 1 if x >= 0.5 else 0 if x >=0 else -1))
+    partial_df.loc[['_TOTAL', ''], '!'] = None
+
+    monthlyWarnings = partial_df.loc[partial_df['!'] == 1, ['Δ BUDGET (%)']]
+    monthlyWarnings.insert(loc = 0, column = 'MESE', value = month)
+
+    if 'Investments' in monthlyWarnings.index:
+        monthlyWarnings = monthlyWarnings.drop(index = 'Investments')
+    return partial_df, monthlyWarnings.reset_index()
 
-    groupedByCategory = df[[groupby, feature, 'IMPORTO']].groupby(by = [groupby, feature], as_index=False).sum() 
-    graphs.creteAreaPlots(groupedByCategory, outputFolder, feature = feature, groupby = groupby)
+@tracing.traced
+def expensive_graphs(cube, outputFolder, variants = [('MESE', 'CATEGORIA'), ('TRIMESTRE', 'CATEGORIA'), ('TRIMESTRE', 'CAUSALE ABI')]):
+    from utils import graphs # matplotlib is imported only to draw the graphs
+    df = cube[cube['SEGNO'] < 0]
 
-    print(f"[DONE] GRAPH of {feature} by {groupby}\n")
+    # Load the budget once for all the graphs
+    budget = loadBudget() if any(feature == 'CATEGORIA' for _, feature in variants) else None
+    graphs.renderAreaPlots(df, outputFolder, variants, budget)
 
-def compute_incomes(df, outputFolder):
+    for groupby, feature in variants:
+        print(f"[DONE] GRAPH of {feature} by {groupby}\n")
+
+@tracing.traced
+def compute_incomes(cube, outputFolder):
+    from utils.reportWriter import ReportWriter # xlsxwriter is imported only to write the workbooks
 
     col_to_group = ['ANNO', 'TRIMESTRE','MESE']
     
     # Filter only incomes
-    df = df[df['IMPORTO'] > 0]
+    df = cube[cube['SEGNO'] > 0]
 
     # Filter only relevant columns
-    df = df[['CAUSALE ABI', 'DESC', 'IMPORTO'] + col_to_group]
-    df['DESC'] += "!"
-    df['#'] = 1
+    df = df[['CAUSALE ABI', 'DESC', 'IMPORTO', '#'] + col_to_group]
 
     stats = dict()
 
     # Compute the overview
-    stats['Overview'] = df[['CAUSALE ABI', 'IMPORTO']].groupby(by = ['CAUSALE ABI']).sum().sort_values(by = 'IMPORTO', ascending = False)
-    orderedFeatures = stats['Overview'].index.to_list()
+    stats['Overview'] = df[['CAUSALE ABI', 'IMPORTO']].groupby(by = ['CAUSALE ABI'], observed = True).sum().sort_values(by = 'IMPORTO', ascending = False) / 100
+    orderedFeatures = stats['Overview'].index
 
     # Group incomes
     for col in col_to_group:
-        grouped_df = df[['CAUSALE ABI', 'IMPORTO', '#','DESC', col]].groupby(by = ['CAUSALE ABI', col]).sum()
-        
-        groupedByDesc = df[['DESC', 'IMPORTO', col]].groupby(by = ['DESC', col]).sum()
+        grouped_df = df[['CAUSALE ABI', 'IMPORTO', '#', col]].groupby(by = ['CAUSALE ABI', col], observed = True).sum()
+        grouped_df['IMPORTO'] = grouped_df['IMPORTO'] / 100
 
         # Add the descriptions
-        grouped_df['DESC'] = grouped_df['DESC'].str.split('!').map(lambda items: [item for item in items if item != ""]).apply(Counter)
-        grouped_df['DESC'] = grouped_df['DESC'].map(lambda count: sorted(count.items(), key = lambda item: item[1], reverse=True))
-        grouped_df['DESC'] = grouped_df.apply(
-            lambda df_row: [expensive + tuple([groupedByDesc.loc[[(expensive[0] + '!', df_row.name[1])], 'IMPORTO'].round(2).iloc[0]])
-                            for expensive in df_row['DESC']], axis = 1)
-        grouped_df['DESC'] = grouped_df['DESC'].map(lambda items: '\n '.join([item[0] + 
-                                                                             (f" (x{item[1]}, " if item[1] > 1 else ' (') + 
-                                                                             str(int(item[2]) if item[2] >= 1 else item[2]) + " €)"
-                                                                             for item in items]))
+        grouped_df['DESC'] = summarize_operations(df, keys = ['CAUSALE ABI', col], sort_by = ['#'], sep = '\n ')
 
         # Sort dataframe
-        grouped_df['rank'] = grouped_df.apply(lambda df_row: orderedFeatures.index(df_row.name[0]), axis = 1)
+        grouped_df['rank'] = group_ranks(grouped_df.index.get_level_values('CAUSALE ABI'), orderedFeatures)
         grouped_df = grouped_df.sort_values(by = ['rank', col], ascending = [True, False]).drop(columns = ['rank'])
 
         stats[col] = grouped_df
 
     # Save the stats
-    with pd.ExcelWriter(path.join(outputFolder, 'incomes.xlsx')) as excelFile:
-          
-        # Formats
-        excelFile.book.formats[0].set_font_size(16)
-        excelFile.book.formats[0].set_align('vcenter')
-
-        euro_fmt = excelFile.book.add_format({'num_format': '#,##0 €', 'font_size': 16})
-        header_format = excelFile.book.add_format({'bg_color': '#3D3B40', 'font_color': 'white', 'bold': False, 'valign': 'center', 'font_size': 16})
+    euro_fmt = {'num_format': '#,##0 €', 'font_size': 16}
+    header_format = {'bg_color': '#3D3B40', 'font_color': 'white', 'bold': False, 'valign': 'center', 'font_size': 16}
+    with ReportWriter(path.join(outputFolder, 'incomes.xlsx'), defaultFormat = {'font_size': 16, 'valign': 'vcenter'}) as report:
         for featureName, grouped_df in stats.items():
-            grouped_df.to_excel(excelFile, sheet_name = featureName)
 
             # Graph settings
-            sheet = excelFile.sheets[featureName]
-            sheet.set_row(0, None, header_format)
-            value_col = 'B1:B999' if featureName == 'Overview' else 'C1:C999' 
-            sheet.set_column(value_col, width = 8, cell_format = euro_fmt)
-            sheet.conditional_format(value_col, {'type': '2_color_scale', 'min_color': '#E1F0DA', 'max_color': '#99BC85'})
-            sheet.autofit()
+            value_col = 'B' if featureName == 'Overview' else 'C' 
+            sheet = report.writeFrame(featureName, grouped_df, header = header_format, columns = {f'{value_col}:{value_col}': {'width': 8, 'format': euro_fmt}})
+            sheet.conditional_format(f'{value_col}1:{value_col}999', {'type': '2_color_scale', 'min_color': '#E1F0DA', 'max_color': '#99BC85'})
 
 def cutoff_period():
 
@@ -268,49 +296,47 @@ def cutoff_period():
 
     return cutoff_date, cutoff_cashAmount
 
-def monthly_stats(df, outputFolder):
+def running_balance(monthlyNet, cutoff_amount, checkpointFile = None, version = ''):
+    balance = pd.Series(np.nan, index = monthlyNet.index)
 
-    # Save the period
-    period = pd.Series({'Last Transaction': df['VALUTA'].iloc[0], 'First Transaction': df['VALUTA'].iloc[-1]}, name  = 'Date')
-    period = period.dt.strftime('%d/%m/%Y')
+    # Reuse the month-end balances until the first month whose total has changed
+    checkpoints = store.readMemo(checkpointFile, version) if checkpointFile else None
+    start = 0
+    if checkpoints is not None:
+        checkpoints = checkpoints.set_index('MESE').reindex(monthlyNet.index)
+        start = int(np.isclose(checkpoints['NET'], monthlyNet).cumprod().sum())
+        balance.iloc[:start] = checkpoints["LIQUIDITA'"].iloc[:start]
 
-    # Create the macro-category
-    df['MACRO-CATEGORIA'] = df['IMPORTO'].map(lambda value: 'ENTRATE' if value > 0 else 'USCITE')
-    df.loc[df['CATEGORIA'] == 'Investments', 'MACRO-CATEGORIA'] = 'INVESTIMENTI'
+    # Extend the balance from the last valid checkpoint
+    opening_amount = balance.iloc[start - 1] if start > 0 else cutoff_amount
+    balance.iloc[start:] = opening_amount + monthlyNet.iloc[start:].cumsum()
+
+    if checkpointFile:
+        store.writeMemo(checkpointFile, pd.DataFrame({'MESE': monthlyNet.index, 'NET': monthlyNet.to_numpy(), "LIQUIDITA'": balance.to_numpy()}), version)
+    return balance
 
-    # Sort the dataframe
-    df = df.sort_values(by = 'DATA').reset_index(drop = True)
+@tracing.traced
+def monthly_stats(cube, outputFolder, checkpointFile = None):
+    from utils.reportWriter import ReportWriter # xlsxwriter is imported only to write the workbooks
+
+    # Save the period
+    period = pd.Series({'Last Transaction': cube.attrs['last_transaction'], 'First Transaction': cube.attrs['first_transaction']}, name  = 'Date')
+    period = pd.to_datetime(period).dt.strftime('%d/%m/%Y')
 
     # Get the cutoff date and amount
     cutoff_date, cutoff_amount = cutoff_period()
-    actual_cutoff_date = df['DATA'].iloc[0]
+    actual_cutoff_date = pd.to_datetime(cube.attrs['first_date'])
     assert np.abs(actual_cutoff_date - cutoff_date) < np.timedelta64(7, 'D'), f"The cutoff date ({cutoff_date}) is not correct! First date found: {actual_cutoff_date}"
-    
-    # Add the cash amount
-    cutoff_transaction = df[df['DATA'] <= actual_cutoff_date].iloc[-1].name
-    df.loc[cutoff_transaction:, "LIQUIDITA"] = cutoff_amount + df.loc[cutoff_transaction:, 'IMPORTO'].cumsum()
-
-    #df.to_excel(path.join(outputFolder, 'tmp.xlsx'))
-
-    # Group the months
-    groupedDf = df[['MESE', 'IMPORTO', 'MACRO-CATEGORIA']].groupby(by = ['MESE', 'MACRO-CATEGORIA']).sum() #, as_index = False
-
-    # Create the new data representation
-    monthlyStats = []
-    for month in groupedDf.index.get_level_values(0).unique():
-
-        # Stats
-        stats = groupedDf.loc[month, 'IMPORTO']
-        stats['MESE'] = month
-
-        # Cash 
-        cash = df.loc[df['VALUTA'].dt.to_period('M') == month, 'LIQUIDITA'].dropna()
-        if len(cash) > 0:
-            stats["LIQUIDITA'"] = cash.iloc[-1]
-        monthlyStats.append(stats)
-    monthlyStats = pd.DataFrame(monthlyStats)
-    monthlyStats = monthlyStats[['MESE', 'ENTRATE', 'USCITE', 'INVESTIMENTI', "LIQUIDITA'"]]
-    monthlyStats = monthlyStats.fillna(value = 0).set_index('MESE')
+
+    # Group the months (including the months without transactions)
+    monthlyStats = cube.pivot_table(index = 'MESE', columns = 'MACRO-CATEGORIA', values = 'IMPORTO', aggfunc = 'sum', fill_value = 0) / 100
+    months = pd.period_range(monthlyStats.index.min(), monthlyStats.index.max(), freq = 'M', name = 'MESE')
+    monthlyStats = monthlyStats.reindex(index = months, columns = ['ENTRATE', 'USCITE', 'INVESTIMENTI'], fill_value = 0)
+    monthlyStats.columns.name = None
+
+    # Add the cash amount (balance before the first transaction + running total)
+    monthlyStats["LIQUIDITA'"] = running_balance(monthlyStats.sum(axis = 1), cutoff_amount, checkpointFile, 
+                                                 version = f"{cutoff_date.date()}|{cutoff_amount}")
     monthlyStats = monthlyStats.sort_index(ascending = False)
 
     # Save the findings
@@ -318,27 +344,20 @@ def monthly_stats(df, outputFolder):
               'USCITE': {'MAX': '#EF9A9A', 'MIN': '#E53935'}, 
               'INVESTIMENTI': {'MAX': '#81D4FA', 'MIN': '#0288D1'}, 
               "LIQUIDITA'": {'MAX': '#F4511E', 'MIN': '#FFCCBC'}}
-    with pd.ExcelWriter(path.join(outputFolder, 'monthlyStats.xlsx'),  engine = 'xlsxwriter', datetime_format="mmmm yyyy") as excelFile:
+    header_format = {'bg_color': '#3D3B40', 'font_color': 'white', 'bold': False, 'valign': 'center', 'font_size': 18}
+    grey_format = {'bg_color': '#EEEEEE','font_size': 18}
+    euro_fmt = {'num_format': '#,##0 €', 'font_size': 18}
+    with ReportWriter(path.join(outputFolder, 'monthlyStats.xlsx'), defaultFormat = {'font_size': 18}, dateFormat = "mmmm yyyy") as report:
 
         # Save the main sheet
-        monthlyStats.to_excel(excelFile, sheet_name = 'Months', index = True, freeze_panes=(1, 0))
-        sheet = excelFile.sheets['Months']
+        sheet = report.writeFrame('Months', monthlyStats, header = header_format, freeze_panes = (1, 0), columns = {'B:E': {'format': euro_fmt}})
 
         # Graphical settings
-        excelFile.book.formats[0].set_font_size(18)
-        
-        header_format = excelFile.book.add_format({'bg_color': '#3D3B40', 'font_color': 'white', 'bold': False, 'valign': 'center', 'font_size': 18})
-        grey_format = excelFile.book.add_format({'bg_color': '#EEEEEE','font_size': 18})
-        euro_fmt = excelFile.book.add_format({'num_format': '#,##0 €', 'font_size': 18})
-        sheet.set_column('B1:E999', cell_format = euro_fmt)
-
         for col_idk, colName in enumerate(monthlyStats.columns):
             sheet.conditional_format(0, col_idk + 1, 999, col_idk + 1, {
                     'type': '2_color_scale', 'min_color': colors[colName]['MIN'], 'max_color': colors[colName]['MAX']})
-        sheet.set_row(0, None, header_format)
 
         sheet.conditional_format(f'A2:A{len(monthlyStats)}', {
-            'type':'formula', 'criteria': "=MOD(ROW(),2)=0", 'format':  grey_format})
+            'type':'formula', 'criteria': "=MOD(ROW(),2)=0", 'format': report.style(grey_format)})
       
-        sheet.autofit()
-        period.to_excel(excelFile, sheet_name = 'Period', index = True)
\ No newline at end of file
+        report.writeFrame('Period', period)
@@ -0,0 +1,185 @@
+from os import path, listdir, rename, replace
+from shutil import rmtree
+from uuid import uuid4
+from json import dumps, loads
+from hashlib import md5
+import pickle
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# LOCAL IMPORTS
+from utils import tracing
+
+# Columns persisted in the store (the period columns are derived at load time)
+STORE_COLUMNS = ['DATA', 'VALUTA', 'DESCRIZIONE OPERAZIONE', 'CAUSALE ABI', 'IMPORTO', 'DESC', 'CATEGORIA', 'ID']
+PARTITION_KEY = 'MESE'
+
+# Explicit schema of the partition files (an inferred one would type a column without values, e.g. CATEGORIA of an income-only export, as null)
+STORE_SCHEMA = pa.schema([('DATA', pa.timestamp('ns')), ('VALUTA', pa.timestamp('ns')), ('DESCRIZIONE OPERAZIONE', pa.string()), 
+                          ('CAUSALE ABI', pa.string()), ('IMPORTO', pa.int64()), ('DESC', pa.string()), ('CATEGORIA', pa.string()), ('ID', pa.int64())])
+
+# Compact schema: low-cardinality strings as categoricals, amounts in cents and 64-bit IDs (first 16 hex digits of the MD5)
+CATEGORICAL_COLUMNS = ['DESCRIZIONE OPERAZIONE', 'CAUSALE ABI', 'DESC', 'CATEGORIA']
+SCHEMA_VERSION = 2
+
+def transactionIDs(descriptions):
+
+    # A missing description has the ID of the empty one
+    digests = b''.join(md5((desc if isinstance(desc, str) else '').encode('UTF-8')).digest()[:8] for desc in descriptions)
+    return np.frombuffer(digests, dtype = '>i8').astype('int64')
+
+def parseID(hexID):
+
+    # The full MD5 (legacy IDs) is truncated to the first 16 hex digits
+    value = int(str(hexID)[:16], 16)
+    return value - 2**64 if value >= 2**63 else value
+
+def formatIDs(ids):
+    return pd.Series(ids).map(lambda value: format(value % 2**64, '016x'))
+
+def toCents(euros):
+    return (euros * 100).round().astype('int64')
+
+def compactTransactions(df):
+    if 'IMPORTO' in df.columns and not pd.api.types.is_integer_dtype(df['IMPORTO']):
+        df['IMPORTO'] = toCents(df['IMPORTO'])
+
+    # Categories in alphabetical order (the groupbys sort by category order)
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            column = df[col].astype('category').cat.remove_unused_categories()
+            df[col] = column.cat.reorder_categories(column.cat.categories.sort_values())
+    return df
+
+def concatTransactions(dfs):
+
+    # Concatenate the frames keeping the categoricals (union of the categories)
+    df = pd.concat([frame.drop(columns = CATEGORICAL_COLUMNS, errors = 'ignore') for frame in dfs], ignore_index = True)
+    for col in CATEGORICAL_COLUMNS:
+        if col in dfs[0].columns:
+            df[col] = union_categoricals([frame[col].astype('category') for frame in dfs], sort_categories = True)
+    return df[dfs[0].columns]
+
+def storeExists(storeFolder):
+    return path.exists(storeFolder) and len(listdir(storeFolder)) > 0
+
+def _dataset(storeFolder, schema = STORE_SCHEMA):
+
+    # The files are read with the store schema (inferred only to detect a legacy store)
+    partitioning = ds.partitioning(pa.schema([(PARTITION_KEY, pa.string())]), flavor = 'hive')
+    return ds.dataset(storeFolder, format = 'parquet', partitioning = partitioning,
+                      schema = schema.append(pa.field(PARTITION_KEY, pa.string())) if schema is not None else None)
+
+def migrateStore(storeFolder):
+    if not storeExists(storeFolder) or pa.types.is_integer(_dataset(storeFolder, schema = None).schema.field('IMPORTO').type):
+        return False
+
+    # Rewrite the legacy store (amounts in euros and hexadecimal IDs) with the compact schema
+    df = _dataset(storeFolder, schema = None).to_table(columns = STORE_COLUMNS).to_pandas()
+    df['ID'] = transactionIDs(df['DESCRIZIONE OPERAZIONE'])
+    legacyFolder = storeFolder + '.legacy'
+    rename(storeFolder, legacyFolder)
+    appendTransactions(storeFolder, df)
+    rmtree(legacyFolder)
+    return True
+
+@tracing.traced
+def readTransactions(storeFolder, columns = None, months = None):
+    if not storeExists(storeFolder):
+        return pd.DataFrame(columns = columns if columns else STORE_COLUMNS)
+
+    # Read only the requested columns and monthly partitions
+    months_filter = ds.field(PARTITION_KEY).isin([str(month) for month in months]) if months is not None else None
+    table = _dataset(storeFolder).to_table(columns = columns if columns else STORE_COLUMNS, filter = months_filter)
+
+    # Dictionary-encode the strings (categoricals in pandas)
+    for col in CATEGORICAL_COLUMNS:
+        if col in table.column_names:
+            table = table.set_column(table.column_names.index(col), col, table.column(col).dictionary_encode())
+    return compactTransactions(table.to_pandas())
+
+@tracing.traced
+def appendTransactions(storeFolder, df, subset = ['VALUTA', 'IMPORTO']):
+    df = compactTransactions(df[STORE_COLUMNS].copy()).drop_duplicates(subset = subset)
+
+    # Drop the transactions already stored (only the touched months are scanned)
+    months = df['VALUTA'].dt.strftime('%Y-%m')
+    stored_df = readTransactions(storeFolder, columns = subset, months = months.unique())
+    if len(stored_df) > 0:
+        isStored = pd.MultiIndex.from_frame(df[subset]).isin(pd.MultiIndex.from_frame(stored_df[subset]))
+        df, months = df[~isStored], months[~isStored]
+
+    if len(df) == 0:
+        return 0
+
+    # Append a new file to each monthly partition (the categoricals are stored as plain strings, the explicit schema types also the columns without values)
+    df = df.astype({col: 'object' for col in CATEGORICAL_COLUMNS})
+    table = pa.Table.from_pandas(df.assign(**{PARTITION_KEY: months}), schema = STORE_SCHEMA.append(pa.field(PARTITION_KEY, pa.string())), 
+                                 preserve_index = False)
+    pq.write_to_dataset(table, storeFolder, partition_cols = [PARTITION_KEY], existing_data_behavior = 'overwrite_or_ignore',
+                        basename_template = f"part-{uuid4().hex}-{{i}}.parquet")
+    return len(df)
+
+def readMemo(memoFile, version):
+    if not path.exists(memoFile):
+        return None
+
+    # Discard the memo built with different taxonomies
+    table = pq.read_table(memoFile)
+    if table.schema.metadata.get(b'version') != version.encode():
+        return None
+    return table.to_pandas()
+
+def writeMemo(memoFile, df, version):
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'version': version.encode()})
+    pq.write_table(table, memoFile)
+
+def readPieces(piecesFile, version):
+    if not path.exists(piecesFile):
+        return dict()
+
+    # Results cached by partition (discarded when they were computed with different settings)
+    try:
+        with open(piecesFile, 'rb') as file:
+            cached = pickle.load(file)
+    except (pickle.UnpicklingError, EOFError, AttributeError):
+        return dict()
+    return cached['pieces'] if cached['version'] == version else dict()
+
+def writePieces(piecesFile, pieces, version):
+    with open(piecesFile + '.tmp', 'wb') as file:
+        pickle.dump({'version': version, 'pieces': pieces}, file)
+    replace(piecesFile + '.tmp', piecesFile)
+
+def writeCube(cubeFile, cube):
+    cube.to_parquet(cubeFile, index = False)
+
+def readCube(cubeFile):
+    if not path.exists(cubeFile):
+        return None
+    return pd.read_parquet(cubeFile)
+
+def writeArrow(arrowFile, df):
+
+    # Arrow IPC file (the attributes are kept in the schema metadata)
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'attrs': dumps(df.attrs).encode()})
+    with pa.OSFile(arrowFile, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+@tracing.traced
+def mapArrow(arrowFile):
+
+    # Memory-map the file: with a block per column, the numeric columns (amounts, counts, signs) stay read-only views of the page cache 
+    # shared by all the processes, while the periods and the strings are still converted (copied) by each worker
+    with pa.memory_map(arrowFile) as source:
+        table = pa.ipc.open_file(source).read_all()
+    attrs = loads(table.schema.metadata.get(b'attrs', b'{}'))
+    df = table.to_pandas(split_blocks = True, self_destruct = True)
+    df.attrs = attrs
+    return df
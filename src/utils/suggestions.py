@@ -0,0 +1,97 @@
+from os import path
+from hashlib import md5
+import numpy as np
+import pandas as pd
+
+# LOCAL IMPORTS
+from utils import store
+
+# Inverted index of the categorized expenses: postings of the tokens of each description (ID), counted by category when read
+INDEX_FILE = 'suggestions.parquet'
+POSTING_COLUMNS = ['ID', 'TOKEN', 'CATEGORIA']
+TOKEN_PATTERN = r'[^\W\d_]{3,}'
+STOP_WORDS = {'srl', 'spa', 'snc', 'sas', 'del', 'della', 'dei', 'per', 'and', 'the', 'www', 'com'}
+
+# Tokens whose most frequent category does not hold the majority of their descriptions are too generic to suggest one (e.g. cities)
+# or mostly found in uncategorized descriptions
+MIN_SHARE = 0.5
+
+def tokenize(descriptions):
+
+    # Distinct words of each description (row: position of the description)
+    tokens = pd.Series(np.asarray(descriptions, dtype = 'object')).astype('str').str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+    tokens = pd.DataFrame({'ROW': tokens.index, 'TOKEN': tokens.to_numpy()})
+    return tokens[~tokens['TOKEN'].isin(STOP_WORDS)].drop_duplicates()
+
+def indexVersion(version, overrides):
+
+    # The final categories also depend on the one-off transactions
+    return md5(repr((version, sorted(overrides.items()))).encode('UTF-8')).hexdigest()
+
+def indexDescriptions(expenses):
+
+    # Postings of the expense descriptions (ID, DESC and final CATEGORIA of each description)
+    tokens = tokenize(expenses['DESC'])
+    rows = tokens['ROW'].to_numpy()
+    return pd.DataFrame({'ID': expenses['ID'].to_numpy(dtype = 'int64')[rows], 'TOKEN': tokens['TOKEN'].to_numpy(),
+                         'CATEGORIA': expenses['CATEGORIA'].to_numpy(dtype = 'object')[rows]}, columns = POSTING_COLUMNS)
+
+def updateIndex(indexFile, expenses, version):
+
+    # Add only the descriptions not indexed yet (all of them when the index has been built with different taxonomies)
+    postings = store.readMemo(indexFile, version)
+    if postings is not None:
+        expenses = expenses[~expenses['ID'].isin(postings['ID'].unique())]
+        if len(expenses) == 0:
+            return postings
+    postings = pd.concat([postings, indexDescriptions(expenses)]) if postings is not None else indexDescriptions(expenses)
+    store.writeMemo(indexFile, postings, version)
+    return postings
+
+def countTokens(postings):
+
+    # Number of descriptions of each category that contain each token
+    postings = postings[postings['CATEGORIA'].notna()]
+    return postings.groupby(by = ['TOKEN', 'CATEGORIA']).size().rename('N').astype('int64').reset_index()
+
+def readIndex(dataFolder):
+    indexFile = path.join(dataFolder, INDEX_FILE)
+    return countTokens(pd.read_parquet(indexFile) if path.exists(indexFile) else pd.DataFrame(columns = POSTING_COLUMNS))
+
+def suggestCategories(index, cube, alternatives = 3):
+
+    # Expenses without a category (grouped by description)
+    others = cube[(cube['SEGNO'] < 0) & (cube['CATEGORIA'] == 'Other')]
+    others = others.groupby(by = 'DESC', observed = True)[['IMPORTO', '#']].sum().sort_values(by = 'IMPORTO').reset_index()
+    others['DESC'] = others['DESC'].astype('str')
+
+    # Look up the tokens of each description: share of the token among the categories, discounted for the rare tokens
+    # ("Other" is not a category to learn, but it counts in the shares)
+    totals = index.groupby(by = 'TOKEN')['N'].transform('sum')
+    weights = index.assign(SHARE = index['N'] / totals, WEIGHT = index['N'] / totals * (1 - 1 / (totals + 1)))
+    weights = weights[weights['CATEGORIA'] != 'Other']
+    weights = weights[weights.groupby(by = 'TOKEN')['SHARE'].transform('max') > MIN_SHARE]
+    tokens = tokenize(others['DESC'])
+    tokenCounts = tokens.groupby(by = 'ROW').size()
+    matches = tokens.merge(weights[['TOKEN', 'CATEGORIA', 'WEIGHT']], on = 'TOKEN')
+
+    # Rank the categories of each description (score: average weight over its tokens)
+    scores = matches.groupby(by = ['ROW', 'CATEGORIA'])['WEIGHT'].sum().reset_index()
+    scores['SCORE'] = (scores['WEIGHT'] / tokenCounts.reindex(scores['ROW']).to_numpy()).round(2)
+    scores = scores.sort_values(by = ['ROW', 'SCORE', 'CATEGORIA'], ascending = [True, False, True])
+    best = scores.drop_duplicates(subset = 'ROW').set_index('ROW')
+
+    # Candidate keyword: the token of the description that best identifies the suggested category
+    keywords = matches.merge(best[['CATEGORIA']].reset_index(), on = ['ROW', 'CATEGORIA'])
+    keywords = keywords.assign(LENGTH = keywords['TOKEN'].str.len()).sort_values(by = ['ROW', 'WEIGHT', 'LENGTH'], ascending = [True, False, False])
+    keywords = keywords.drop_duplicates(subset = 'ROW').set_index('ROW')['TOKEN']
+
+    ranked = scores.groupby(by = 'ROW', sort = False).head(alternatives)
+    ranked = (ranked['CATEGORIA'] + ' (' + ranked['SCORE'].astype('str') + ')').groupby(ranked['ROW']).agg(' | '.join)
+
+    others['IMPORTO'] = others['IMPORTO'] / -100
+    others['SUGGERIMENTO'] = best['CATEGORIA'].reindex(others.index)
+    others['SCORE'] = best['SCORE'].reindex(others.index)
+    others['PAROLA CHIAVE'] = keywords.reindex(others.index)
+    others['CLASSIFICA'] = ranked.reindex(others.index)
+    return others
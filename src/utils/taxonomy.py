@@ -0,0 +1,173 @@
+from os import path, replace
+from json import load
+from hashlib import md5
+import pickle
+import pandas as pd
+import re
+
+# LOCAL IMPORTS
+from utils import store, tracing, budgets
+
+# Rules to clean the bank descriptions: the first triggered rule extracts the group "desc" with its first matching pattern
+DESCRIPTION_RULES = [
+    {'name': 'Bonifico', 'trigger': 'vostra disposizione a favore', 'patterns': [r'(?P<desc>a fav: [^-]*?)(?:id\.msg|-|$)']},
+    {'name': 'POS', 'trigger': 'pagamento tramite pos', 'patterns': [r'presso:(?P<desc>.*)', r'\.00 (?P<desc>.*)', r':.{0,11}(?P<desc>.*)']},
+    {'name': 'SDD', 'trigger': 'pagamenti diversi cred. ', 'patterns': [r'cred\. (?P<desc>.*?)(?:id\.mandato|$)'], 'aliases': {'paypal': 'PayPal'}},
+    {'name': 'Polizza', 'trigger': 'imposte e tasse polizza', 'patterns': [r'(?P<desc>periodo bollo.*)']}]
+INCOME_DESCRIPTION_RULES = [
+    {'name': 'Ordinante', 'trigger': 'causale', 'patterns': [r'ordinante: (?P<desc>.*?)causale', r'^.{10}(?P<desc>.*?)causale']},
+    {'name': 'Emolumenti', 'trigger': 'emolumenti', 'patterns': [r'per emolumenti.(?P<desc>.*?)(?:accredito competenze|$)']},
+    {'name': 'Cedole', 'trigger': 'cedole', 'patterns': [r'cedole (?P<desc>.*?)(?:quantit|$)']}]
+
+# Sources of the taxonomies (descriptionRules.json is optional)
+TAXONOMY_FILES = ['causaliABI.json', 'expensiveCategories.json', 'oneOffTransactions.json', 'descriptionRules.json', 'budget.xlsx']
+
+# Taxonomies already loaded by this process
+_loaded = dict()
+
+def loadTaxonomies(folderData = path.join('taxonomies'), cacheFile = None):
+    if cacheFile is None:
+        cacheFile = path.join(path.dirname(path.abspath(folderData)), 'data', 'taxonomies.pickle')
+    signature = sourcesSignature(folderData)
+
+    # (1) Memory
+    if _loaded.get(folderData, {}).get('signature') == signature:
+        return _loaded[folderData]['taxonomies']
+
+    # (2) Binary cache (built by a previous run or by the parent process)
+    cached = None
+    if path.exists(cacheFile):
+        try:
+            with open(cacheFile, 'rb') as file:
+                cached = pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, AttributeError):
+            cached = None
+
+    # (3) Source files
+    if cached is None or cached['signature'] != signature:
+        cached = {'signature': signature, 'taxonomies': compileTaxonomies(folderData)}
+        if path.exists(path.dirname(cacheFile)):
+            with open(cacheFile + '.tmp', 'wb') as file:
+                pickle.dump(cached, file)
+            replace(cacheFile + '.tmp', cacheFile)
+
+    _loaded[folderData] = cached
+    return cached['taxonomies']
+
+def sourcesSignature(folderData):
+
+    # Modification time and size of each source (and the built-in rules, the schema of the IDs and of the budget)
+    signature = [md5(repr((DESCRIPTION_RULES, INCOME_DESCRIPTION_RULES, store.SCHEMA_VERSION, budgets.BUDGET_COLUMNS)).encode('UTF-8')).hexdigest()]
+    for fileName in TAXONOMY_FILES:
+        filePath = path.join(folderData, fileName)
+        signature.append((fileName, path.getmtime(filePath), path.getsize(filePath)) if path.exists(filePath) else (fileName, None))
+    return signature
+
+@tracing.traced
+def compileTaxonomies(folderData):
+    causaliAbi = loadJSON(folderData, 'causaliABI.json')
+    expensiveCategories = loadJSON(folderData, 'expensiveCategories.json')
+    oneOffTransactions = loadJSON(folderData, 'oneOffTransactions.json')
+    customRules = loadJSON(folderData, 'descriptionRules.json', default = dict())
+    budget = budgets.readBudget(folderData)
+
+    validateTaxonomies(causaliAbi, expensiveCategories, oneOffTransactions, budget, customRules)
+
+    expensiveMapping = {expensive: cat for cat, expList in expensiveCategories.items() for expensive in expList}
+    return {'causaliABI': {str(code): name for code, name in causaliAbi.items()},
+            'expensives': compileExpensives(expensiveMapping),
+            'overrides': compileOneOffTransactions(oneOffTransactions),
+            'descriptionRules': (compileDescriptionRules(customRules.get('expensives', []) + DESCRIPTION_RULES),
+                                 compileDescriptionRules(customRules.get('incomes', []) + INCOME_DESCRIPTION_RULES)),
+            'budget': budget,
+            'version': taxonomyVersion(folderData)}
+
+def loadJSON(folderData, fileName, default = None):
+    filePath = path.join(folderData, fileName)
+    if default is not None and not path.exists(filePath):
+        return default
+    with open(filePath) as jsonFile:
+        return load(jsonFile)
+
+def validateTaxonomies(causaliAbi, expensiveCategories, oneOffTransactions, budget, customRules = dict()):
+    for fileName, taxonomy in [('expensiveCategories.json', expensiveCategories), ('oneOffTransactions.json', oneOffTransactions)]:
+        if not isinstance(taxonomy, dict) or not all(isinstance(items, list) for items in taxonomy.values()):
+            raise Exception(f"Invalid taxonomy {fileName}: each category must be a list\n")
+    if not isinstance(causaliAbi, dict):
+        raise Exception("Invalid taxonomy causaliABI.json: it must map each ABI code to its name\n")
+    validateDescriptionRules(customRules)
+
+    # Categories that would fail the budget comparison
+    unbudgeted = (set(expensiveCategories) | set(oneOffTransactions) | {'Other'}) - set(budget['CATEGORIA'])
+    if len(unbudgeted) > 0:
+        print(f"[WARNING] Categories not in the budget: {', '.join(sorted(unbudgeted))}\n")
+
+def validateDescriptionRules(customRules):
+    if not isinstance(customRules, dict):
+        raise Exception("Invalid taxonomy descriptionRules.json: it must contain the lists 'expensives' and 'incomes'\n")
+
+    # Each pattern must extract exactly one group, named "desc" (str.extract returns a single column)
+    for kind, rules in customRules.items():
+        if not isinstance(rules, list):
+            raise Exception(f"Invalid taxonomy descriptionRules.json: '{kind}' must be a list of rules\n")
+        for rule in rules:
+            name = rule.get('name', rule.get('trigger')) if isinstance(rule, dict) else rule
+            if not isinstance(rule, dict) or not isinstance(rule.get('trigger'), str) or not isinstance(rule.get('patterns'), list):
+                raise Exception(f"Invalid description rule ({kind}: {name}): it must have a 'trigger' and a list of 'patterns'\n")
+            for pattern in rule['patterns']:
+                try:
+                    compiled = re.compile(pattern, re.IGNORECASE | re.DOTALL)
+                except (re.error, TypeError) as error:
+                    raise Exception(f"Invalid description rule ({kind}: {name}): {pattern!r} is not a valid pattern ({error})\n")
+                if 'desc' not in compiled.groupindex or compiled.groups != 1:
+                    raise Exception(f"Invalid description rule ({kind}: {name}): {pattern!r} must have only the group (?P<desc>...)\n")
+
+def taxonomyVersion(folderData):
+
+    # Fingerprint of everything that affects the derived description fields
+    fingerprint = md5(repr((DESCRIPTION_RULES, INCOME_DESCRIPTION_RULES, store.SCHEMA_VERSION)).encode('UTF-8'))
+    for fileName in ['expensiveCategories.json', 'descriptionRules.json']:
+        if path.exists(path.join(folderData, fileName)):
+            with open(path.join(folderData, fileName), 'rb') as jsonFile:
+                fingerprint.update(jsonFile.read())
+    return fingerprint.hexdigest()
+
+def compileKeywords(keywords):
+
+    # Single pattern that reports every keyword occurrence, including overlapping ones
+    pattern = re.compile('(?=(' + '|'.join(map(re.escape, keywords)) + '))')
+    ranks = dict()
+    for rank, keyword in enumerate(keywords):
+        ranks.setdefault(keyword, rank)
+    return pattern, pd.Series(ranks, dtype = 'float')
+
+def compileExpensives(expensiveMapping):
+
+    # Rank the keywords by taxonomy order (the first match wins)
+    keywords = dict()
+    for expensiveName, expensiveCategory in expensiveMapping.items():
+        keywords.setdefault(expensiveName.lower(), expensiveCategory)
+
+    pattern, ranks = compileKeywords(list(keywords.keys()))
+    return pattern, ranks, list(keywords.values())
+
+def compileOneOffTransactions(oneOffTransactions):
+
+    # Map each transaction ID (64 bits) to its category (the last one wins)
+    overrides = dict()
+    for category, transactions in oneOffTransactions.items():
+        for hex_id in transactions:
+            try:
+                transaction_id = store.parseID(hex_id)
+            except ValueError:
+                raise Exception(f"Invalid one-off transaction ID ({category}): {hex_id}\n")
+            if transaction_id in overrides:
+                print(f"[WARNING] Duplicated one-off transaction: {hex_id} ({overrides[transaction_id]} --> {category})\n")
+            overrides[transaction_id] = category
+    return overrides
+
+def compileDescriptionRules(rules):
+    triggerPattern, triggerRanks = compileKeywords([rule['trigger'].lower() for rule in rules])
+    patterns = [[re.compile(pattern, re.IGNORECASE | re.DOTALL) for pattern in rule['patterns']] for rule in rules]
+    aliases = [{keyword.lower(): alias for keyword, alias in rule.get('aliases', dict()).items()} for rule in rules]
+    return triggerPattern, triggerRanks, patterns, aliases
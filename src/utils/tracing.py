@@ -0,0 +1,139 @@
+from os import path, environ, getpid, makedirs, listdir, remove, rmdir
+from json import dumps, loads, dump
+from time import time_ns, perf_counter, thread_time
+from functools import wraps
+from contextlib import contextmanager
+from inspect import signature
+from threading import Lock, get_ident
+import cProfile
+import pstats
+import sys
+
+# The settings are environment variables, so that they are inherited by the child processes
+TRACE_VARIABLE = 'EXPENSIVE_TRACE'
+PROFILE_VARIABLE = 'EXPENSIVE_PROFILE'
+
+_lock = Lock()
+
+def enable(traceFile, profileStage = None):
+    environ[TRACE_VARIABLE] = path.abspath(traceFile)
+    if profileStage:
+        environ[PROFILE_VARIABLE] = profileStage
+
+    # Drop the spans left by an interrupted run
+    makedirs(_partsFolder(), exist_ok = True)
+    for fileName in listdir(_partsFolder()):
+        remove(path.join(_partsFolder(), fileName))
+
+def enabled():
+    return TRACE_VARIABLE in environ
+
+def _partsFolder():
+    return environ[TRACE_VARIABLE] + '.parts'
+
+def peakRSS():
+
+    # Peak resident memory of the process (MB)
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD), ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t), ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t), ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t), ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 2**20
+
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+
+@contextmanager
+def span(name, **details):
+    if not enabled():
+        yield details
+        return
+
+    # Profile the selected stage
+    profiler = None
+    if environ.get(PROFILE_VARIABLE) in [name, name.split(' (')[0]]:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start, wall, cpu = time_ns() // 1000, perf_counter(), thread_time()
+    try:
+        yield details
+    finally:
+        duration, cpu = perf_counter() - wall, thread_time() - cpu
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(path.join(_partsFolder(), f'{getpid()}-{get_ident()}-{start}.prof'))
+
+        # Chrome trace event (complete event)
+        event = {'name': name, 'ph': 'X', 'ts': start, 'dur': int(duration * 1e6), 'pid': getpid(), 'tid': get_ident(),
+                 'args': {'cpu_ms': round(cpu * 1000, 1), 'peak_rss_mb': round(peakRSS(), 1), **details}}
+        with _lock:
+            with open(path.join(_partsFolder(), f'{getpid()}.jsonl'), 'a') as partFile:
+                partFile.write(dumps(event, default = str) + '\n')
+
+def traced(function = None, label = None):
+
+    # Decorator: one span for each call (the optional labels are the values of some arguments, e.g. the feature)
+    def decorator(function):
+        parameters = signature(function)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return function(*args, **kwargs)
+
+            name = function.__name__
+            if label:
+                bound = parameters.bind(*args, **kwargs)
+                bound.apply_defaults()
+                name += " (" + ", ".join(str(bound.arguments[argument]) for argument in label) + ")"
+
+            with span(name) as details:
+                result = function(*args, **kwargs)
+                details['rows'] = _rows(args, result)
+            return result
+        return wrapper
+    return decorator(function) if function else decorator
+
+def _rows(args, result):
+
+    # Rows of the processed (or returned) dataframe
+    for value in list(args) + [result]:
+        if hasattr(value, 'shape') and hasattr(value, 'columns'):
+            return len(value)
+    return None
+
+def writeTrace():
+    if not enabled():
+        return None
+
+    # Merge the spans of all the processes
+    events, profiles = [], []
+    for fileName in sorted(listdir(_partsFolder())):
+        if fileName.endswith('.prof'):
+            profiles.append(path.join(_partsFolder(), fileName))
+            continue
+        with open(path.join(_partsFolder(), fileName)) as partFile:
+            events.extend(loads(line) for line in partFile if line.strip())
+        remove(path.join(_partsFolder(), fileName))
+
+    # Merge the profiles of the stage (e.g. one call for each feature) into <stage>.prof
+    if profiles:
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path.join(path.dirname(environ[TRACE_VARIABLE]), environ[PROFILE_VARIABLE].replace(' ', '_') + '.prof'))
+        for profileFile in profiles:
+            remove(profileFile)
+    rmdir(_partsFolder())
+
+    with open(environ[TRACE_VARIABLE], 'w') as traceFile:
+        dump({'traceEvents': sorted(events, key = lambda event: event['ts']), 'displayTimeUnit': 'ms'}, traceFile)
+    return environ[TRACE_VARIABLE]
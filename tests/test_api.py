@@ -0,0 +1,153 @@
+from os import path, utime
+from json import loads
+from threading import Thread
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from http.server import ThreadingHTTPServer
+import sys
+import pandas as pd
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'src'))
+
+# LOCAL IMPORTS
+from utils import api, dataLoader, stats, store, suggestions
+
+@pytest.fixture
+def cube():
+
+    # Three months of transactions (amounts in euros, expenses are negative)
+    df = pd.DataFrame([
+        ('2024-01-05', 'Pagamento POS', 'COOP', 'Food', -50.0),
+        ('2024-01-20', 'Pagamento POS', 'COOP', 'Food', -30.0),
+        ('2024-01-25', 'Bonifico in entrata', 'ACME SPA', 'Other', 2000.0),
+        ('2024-02-10', 'Pagamento POS', 'TRENITALIA', 'Transportation', -45.5),
+        ('2024-02-12', 'Pagamento POS', 'BAR SPORT', 'Other', -12.0),
+        ('2024-03-03', 'Pagamento POS', 'ESSELUNGA', 'Food', -120.0)],
+        columns = ['VALUTA', 'CAUSALE ABI', 'DESC', 'CATEGORIA', 'IMPORTO'])
+    df['VALUTA'] = pd.to_datetime(df['VALUTA'])
+    df['DATA'] = df['VALUTA']
+    return stats.build_cube(dataLoader.addPeriods(store.compactTransactions(df)))
+
+@pytest.fixture
+def budget():
+    return pd.DataFrame({'CATEGORIA': ['Food', 'Transportation', 'Transportation'],
+                         'DAL': pd.PeriodIndex([None, None, '2024-03'], freq = 'M'), 'BUDGET': [100, 40, 60]})
+
+def answer(queries, endpoint, **params):
+    return loads(queries.answer(endpoint, tuple(sorted(params.items()))))
+
+def test_spend(cube, budget):
+    queries = api.SpendingQueries(cube, budget)
+    spend = answer(queries, '/spend', **{'from': '2024-01', 'to': '2024-02'})
+
+    assert spend['from'] == '2024-01' and spend['to'] == '2024-02' and spend['by'] == 'CATEGORIA'
+    assert spend['total'] == 137.5
+    assert spend['items'][0] == {'name': 'Food', 'amount': 80.0, 'transactions': 2}
+    assert [item['name'] for item in spend['items']] == ['Food', 'Transportation', 'Other']
+
+    with pytest.raises(ValueError):
+        answer(queries, '/spend', by = 'UNKNOWN')
+
+def test_top(cube, budget):
+    top = answer(api.SpendingQueries(cube, budget), '/top', n = '2', category = 'Food')
+
+    assert top['category'] == 'Food'
+    assert top['items'] == [{'description': 'ESSELUNGA', 'amount': 120.0, 'transactions': 1},
+                            {'description': 'COOP', 'amount': 80.0, 'transactions': 2}]
+
+def test_budget(cube, budget):
+    variance = answer(api.SpendingQueries(cube, budget), '/budget', **{'from': '2024Q1'})
+    items = {item['category']: item for item in variance['items']}
+
+    # The budget of Transportation changes in March
+    assert variance['months'] == 3
+    assert items['Food'] == {'category': 'Food', 'amount': 200.0, 'budget': 300, 'delta': -100.0, 'delta_pct': -0.3333}
+    assert items['Transportation']['budget'] == 140
+    assert variance['unbudgeted'] == ['Other']
+
+def test_invalid_parameters(cube, budget):
+    queries = api.SpendingQueries(cube, budget)
+    for endpoint, params in [('/top', {'n': '-3'}), ('/top', {'n': '0'}), ('/suggest', {'n': '-1'}), ('/top', {'n': 'ten'}),
+                             ('/budget', {'from': '2024-03', 'to': '2024-01'}), ('/spend', {'from': 'March'})]:
+        with pytest.raises(ValueError):
+            answer(queries, endpoint, **params)
+
+def test_suggest(cube, budget):
+
+    # Tokens of the categorized expenses: "sport" is spread over the categories, "bar" mostly identifies the restaurants
+    postings = pd.DataFrame([(1, 'bar', 'Restaurants'), (2, 'bar', 'Restaurants'), (3, 'bar', 'Restaurants'), (4, 'bar', 'Other'),
+                             (5, 'sport', 'Food'), (6, 'sport', 'Transportation')], columns = suggestions.POSTING_COLUMNS)
+    suggested = answer(api.SpendingQueries(cube, budget, index = suggestions.countTokens(postings)), '/suggest')
+
+    assert suggested['items'] == [{'description': 'BAR SPORT', 'amount': 12.0, 'transactions': 1, 'category': 'Restaurants', 'score': 0.3,
+                                   'keyword': 'bar', 'ranking': 'Restaurants (0.3)'}]
+    assert answer(api.SpendingQueries(cube, budget), '/suggest')['items'][0]['category'] is None
+
+def test_cached_answers(cube, budget):
+    queries = api.SpendingQueries(cube, budget)
+    answer(queries, '/months')
+    answer(queries, '/months')
+    assert queries.answer.cache_info().hits == 1
+
+    with pytest.raises(LookupError):
+        answer(queries, '/unknown')
+
+def test_request_handler(tmp_path, monkeypatch, cube, budget):
+
+    # Project with a status file and a taxonomy (the data is loaded from the fixture cube)
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'taxonomies').mkdir()
+    statusFile = tmp_path / 'data' / 'status.json'
+    statusFile.write_text('{"transactions": 6}')
+    taxonomyFile = tmp_path / 'taxonomies' / 'expensiveCategories.json'
+    taxonomyFile.write_text('{"Food": ["COOP"]}')
+
+    loaded = []
+    def loadQueries(projectFolder):
+        loaded.append(api.SpendingQueries(cube, budget, {'transactions': 6}))
+        return loaded[-1]
+    monkeypatch.setattr(api, 'loadQueries', loadQueries)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), api.RequestHandler)
+    server.service = api.SpendingService(str(tmp_path))
+    Thread(target = server.serve_forever, daemon = True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urlopen(url + '/spend?from=2024-03') as response:
+            assert response.headers['Content-Type'] == 'application/json; charset=utf-8'
+            assert loads(response.read())['items'] == [{'name': 'Food', 'amount': 120.0, 'transactions': 1}]
+        with urlopen(url + '/status') as response:
+            assert loads(response.read()) == {'transactions': 6}
+        for endpoint, code in [('/unknown', 404), ('/spend?by=UNKNOWN', 400)]:
+            with pytest.raises(HTTPError) as error:
+                urlopen(url + endpoint)
+            assert error.value.code == code and 'error' in loads(error.value.read())
+
+        # Unexpected errors (e.g. no data) are reported too
+        def failingSpend(self, params):
+            raise Exception('No data!')
+        with monkeypatch.context() as patch:
+            patch.setattr(api.SpendingQueries, 'spend', failingSpend)
+            with pytest.raises(HTTPError) as error:
+                urlopen(url + '/spend?by=DESC')
+            assert error.value.code == 500 and loads(error.value.read()) == {'error': 'Exception: No data!'}
+
+        # The cached answers are reused until the next import (a new status file)
+        with urlopen(url + '/spend?from=2024-03'):
+            pass
+        assert len(loaded) == 1 and loaded[0].answer.cache_info().hits == 1
+
+        utime(statusFile, (statusFile.stat().st_atime, statusFile.stat().st_mtime + 10))
+        with urlopen(url + '/spend?from=2024-03'):
+            pass
+        assert len(loaded) == 2 and loaded[1].answer.cache_info().currsize == 1
+
+        # ... or until the taxonomies change
+        taxonomyFile.write_text('{"Food": ["COOP", "ESSELUNGA"]}')
+        with urlopen(url + '/spend?from=2024-03'):
+            pass
+        assert len(loaded) == 3 and loaded[2].answer.cache_info().currsize == 1
+    finally:
+        server.shutdown()
+        server.server_close()
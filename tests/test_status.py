@@ -0,0 +1,38 @@
+from os import path
+from json import dump
+from time import perf_counter
+from subprocess import run
+import sys
+
+ROOT_FOLDER = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, path.join(ROOT_FOLDER, 'benchmarks'))
+
+# LOCAL IMPORTS
+from benchmark import STATUS_BUDGET
+
+def runStatus(projectFolder, *options):
+    start = perf_counter()
+    result = run([sys.executable, *options, path.join(ROOT_FOLDER, 'src', 'app.py'), 'status'], cwd = projectFolder, capture_output = True, text = True)
+    return result, perf_counter() - start
+
+def test_status(tmp_path):
+
+    # Project with an imported history (only the status file is read)
+    (tmp_path / 'data').mkdir()
+    with open(tmp_path / 'data' / 'status.json', 'w') as jsonFile:
+        dump({'last_day': '2024-03-03T00:00:00', 'first_day': '2024-01-05T00:00:00', 'transactions': 6,
+              'last_transaction': {'DESC': 'ESSELUNGA', 'CATEGORIA': 'Food', 'IMPORTO': '-120.0'}}, jsonFile)
+
+    # Sub-second startup (best of three runs, the first one may compile the bytecode)
+    timings = []
+    for _ in range(3):
+        result, elapsed = runStatus(tmp_path)
+        assert result.returncode == 0, result.stderr
+        timings.append(elapsed)
+    assert '--> TRANSACTIONS: 6' in result.stdout
+    assert min(timings) < STATUS_BUDGET
+
+    # No data library is imported by the command
+    result, _ = runStatus(tmp_path, '-X', 'importtime')
+    imported = {line.split('|')[-1].strip().split('.')[0] for line in result.stderr.splitlines() if line.startswith('import time:')}
+    assert 'pandas' not in imported and 'numpy' not in imported